@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Throughput of the provider hot paths against the fake node: invoice
+# requests, pay requests and payments received from the node, driven
+# straight into a TerminusApp for a range of account counts. Reports
+# ops/s, p50/p99 latency from request to notification, and the bytes
+# persisted, so regressions in persistence or indexing show up.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_app
+#   $ python3 -m benchmarks.bench_app -a 1,1000,100000 --backend sqlite
+
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+from twisted.internet import reactor, defer
+
+from terminus import metrics
+from terminus.account_db import AccountDb
+from benchmarks.fake_node import (make_app, provision_accounts,
+                                  encode_invoice, FakeNexus, dir_bytes)
+
+
+SCENARIOS = ["invoice", "pay", "receive"]
+BALANCE_MSATS = 10 ** 15
+OP_MSATS = 1000
+
+
+class Scenario(object):
+    def __init__(self, app, node, accounts, rng):
+        self.app = app
+        self.node = node
+        self.accounts = accounts
+        self.random = rng
+        self.received = []
+
+    def pick(self):
+        return self.accounts[self.random.randrange(len(self.accounts))]
+
+    def invoice(self):
+        _, shared_seed = self.pick()
+        request_uuid = str(uuid.uuid4())
+        d = self.app.provider_stack.expect(request_uuid)
+        self.app.handle_invoice_request(FakeNexus(shared_seed), OP_MSATS,
+                                        request_uuid)
+        return d
+
+    def pay(self):
+        _, shared_seed = self.pick()
+        request_uuid = str(uuid.uuid4())
+        bolt11 = encode_invoice("%064x" % self.random.getrandbits(256),
+                                OP_MSATS)
+        d = self.app.provider_stack.expect(request_uuid)
+        self.app.handle_pay_request(FakeNexus(shared_seed), bolt11,
+                                    request_uuid)
+        return d
+
+    def setup_receive(self, ops):
+        # pending invoices for the node to report paid, set up untimed
+        for _ in range(ops):
+            account, _ = self.pick()
+            bolt11, payment_hash, preimage = self.node.new_invoice(OP_MSATS)
+            account.add_pending(payment_hash, bolt11)
+            self.app.directory.add_pending(account, payment_hash)
+            self.app.schedule_expiry(account, payment_hash)
+            self.received.append(preimage)
+
+    def receive(self):
+        preimage = self.received.pop()
+        d = self.app.provider_stack.expect(preimage)
+        self.app.node_received_payment_cb(preimage, OP_MSATS)
+        return d
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+@defer.inlineCallbacks
+def run_ops(op, ops, concurrency):
+    latencies = []
+    outcomes = {}
+    sem = defer.DeferredSemaphore(concurrency)
+
+    def timed_op():
+        start = time.perf_counter()
+        d = op()
+        def done(outcome):
+            latencies.append(time.perf_counter() - start)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        d.addCallback(done)
+        return d
+
+    start = time.perf_counter()
+    yield defer.gatherResults([sem.run(timed_op) for _ in range(ops)])
+    # the last notifications waited on their flush, nothing left dirty
+    yield AccountDb.barrier()
+    return time.perf_counter() - start, sorted(latencies), outcomes
+
+
+@defer.inlineCallbacks
+def run_accounts(count, settings):
+    persist_dir = tempfile.mkdtemp(prefix="terminus-bench-")
+    try:
+        app, node = make_app(persist_dir, backend=settings.backend,
+                             persist_interval=settings.persist_interval,
+                             latency=settings.latency / 1000.0,
+                             failure_rate=settings.failure_rate,
+                             max_inflight=settings.max_inflight)
+        start = time.perf_counter()
+        accounts = provision_accounts(app, count, BALANCE_MSATS)
+        yield AccountDb.barrier()
+        print("%d accounts (%s) provisioned in %.2fs" % (
+              count, settings.backend, time.perf_counter() - start))
+        scenario = Scenario(app, node, accounts, random.Random(count))
+        for name in settings.scenarios:
+            if name == "receive":
+                scenario.setup_receive(settings.ops)
+                yield AccountDb.barrier()
+            bytes_before = metrics.PERSIST_BYTES.values.get((), 0)
+            dir_before = dir_bytes(persist_dir)
+            elapsed, latencies, outcomes = yield run_ops(
+                getattr(scenario, name), settings.ops, settings.concurrency)
+            written = metrics.PERSIST_BYTES.values.get((), 0) - bytes_before
+            grown = dir_bytes(persist_dir) - dir_before
+            outcome_counts = " ".join("%s=%d" % kv for kv in
+                                      sorted(outcomes.items()))
+            print("  %-8s %9.0f ops/s  p50 %7.2f ms  p99 %7.2f ms  "
+                  "written %8.1f KiB (%5.0f B/op)  dir +%8.1f KiB  %s" % (
+                  name, settings.ops / elapsed,
+                  percentile(latencies, 0.50) * 1000,
+                  percentile(latencies, 0.99) * 1000,
+                  written / 1024.0, written / settings.ops, grown / 1024.0,
+                  outcome_counts))
+    finally:
+        shutil.rmtree(persist_dir)
+
+
+@defer.inlineCallbacks
+def main(settings):
+    for count in settings.accounts:
+        yield run_accounts(count, settings)
+
+
+parser = argparse.ArgumentParser(prog="bench_app")
+parser.add_argument("-a", "--accounts", type=str, default="1,100,10000",
+                    help="comma separated account counts to run with")
+parser.add_argument("-n", "--ops", type=int, default=2000,
+                    help="operations per scenario")
+parser.add_argument("-c", "--concurrency", type=int, default=32,
+                    help="operations in flight at once")
+parser.add_argument("-s", "--scenarios", type=str,
+                    default=",".join(SCENARIOS),
+                    help="comma separated, of: %s" % ", ".join(SCENARIOS))
+parser.add_argument("--backend", type=str, choices=["json", "sqlite"],
+                    default="json", help="storage backend")
+parser.add_argument("--persist-interval", type=float, default=0.0,
+                    help="PersistInterval seconds")
+parser.add_argument("--latency", type=float, default=0.0,
+                    help="fake node milliseconds per call")
+parser.add_argument("--failure-rate", type=float, default=0.0,
+                    help="fraction of fake node calls that fail")
+parser.add_argument("--max-inflight", type=int, default=8,
+                    help="MaxInflightPayments and MaxInflightInvoices")
+settings = parser.parse_args()
+settings.accounts = [int(a) for a in settings.accounts.split(",")]
+settings.scenarios = settings.scenarios.split(",")
+for name in settings.scenarios:
+    if name not in SCENARIOS:
+        parser.error("unknown scenario: %s" % name)
+
+d = main(settings)
+d.addErrback(lambda f: print(f.getTraceback()))
+d.addBoth(lambda _: reactor.stop())
+reactor.run()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Invoice decoding cost per request with and without the decoded bolt11
+# cache, for the lookups a pay request (amount for the check, amount for
+# the receipt) and an invoice request (payment hash, expiry, amount for the
+# pending invoice) make. Real invoices are needed for real decode costs,
+# one bolt11 per line, e.g. from a node's own invoices:
+#
+#   $ lightning-cli listinvoices | jq -r '.invoices[].bolt11' > invoices.txt
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_bolt11_cache -f invoices.txt
+#   $ python3 -m benchmarks.bench_bolt11_cache -f invoices.txt -n 10000
+
+import sys
+import time
+import argparse
+
+from moneysocket.utl.bolt11 import Bolt11
+
+from terminus.bolt11_cache import Bolt11Cache
+from terminus.metrics import BOLT11_LOOKUPS
+
+
+def pay_uncached(bolt11):
+    Bolt11.get_msats(bolt11)
+    Bolt11.get_msats(bolt11)
+
+
+def invoice_uncached(bolt11):
+    Bolt11.get_payment_hash(bolt11)
+    Bolt11.to_dict(bolt11)
+    Bolt11.get_msats(bolt11)
+
+
+def pay_cached(cache, bolt11):
+    cache.get_msats(bolt11)
+    cache.get_msats(bolt11)
+
+
+def invoice_cached(cache, bolt11):
+    cache.get_payment_hash(bolt11)
+    cache.get_expiry(bolt11)
+    cache.get_msats(bolt11)
+
+
+def run(label, request, invoices, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        request(invoices[i % len(invoices)])
+    elapsed = time.perf_counter() - start
+    print("  %-18s %10.1f us/request" % (label, elapsed / requests * 1e6))
+    return elapsed
+
+
+def lookups():
+    return (BOLT11_LOOKUPS.values.get(("hit",), 0),
+            BOLT11_LOOKUPS.values.get(("miss",), 0))
+
+
+parser = argparse.ArgumentParser(prog="bench_bolt11_cache")
+parser.add_argument("-f", "--invoices", type=str, required=True,
+                    help="file of bolt11 invoices, one per line")
+parser.add_argument("-n", "--requests", type=int, default=1000,
+                    help="requests per path, cycling through the invoices")
+parser.add_argument("-s", "--cache-size", type=int, default=10000,
+                    help="Bolt11CacheSize")
+settings = parser.parse_args()
+
+f = open(settings.invoices, 'r')
+invoices = [line.strip() for line in f if line.strip()]
+f.close()
+if len(invoices) == 0:
+    sys.exit("*** no invoices in %s" % settings.invoices)
+
+print("%d requests per path over %d invoices, cache size %d" % (
+      settings.requests, len(invoices), settings.cache_size))
+for path, uncached, cached in [("pay", pay_uncached, pay_cached),
+                               ("invoice", invoice_uncached,
+                                invoice_cached)]:
+    print(path)
+    before = run("uncached", uncached, invoices, settings.requests)
+    cache = Bolt11Cache(max_size=settings.cache_size)
+    hits, misses = lookups()
+    after = run("cached", lambda b: cached(cache, b), invoices,
+                settings.requests)
+    hits, misses = lookups()[0] - hits, lookups()[1] - misses
+    print("  %-18s %10.1f x  hit rate %.1f%%" % (
+          "speedup", before / after, 100.0 * hits / (hits + misses)))
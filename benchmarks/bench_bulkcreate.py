@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Time to provision N accounts under one name prefix, one create at a time
+# with the old linear name probing versus AccountDb.create_batch() with the
+# directory's per-prefix name counter.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_bulkcreate
+
+import time
+import shutil
+import argparse
+import tempfile
+
+from moneysocket.wad.wad import Wad
+
+from terminus.account import Account
+from terminus.account_db import AccountDb
+from terminus.directory import TerminusDirectory
+from terminus.json_store import JsonAccountStore
+from terminus.sqlite_store import SqliteAccountStore
+
+
+def probe_account_name(directory, name):
+    # the name allocation create used before
+    i = 0
+    while directory.lookup_by_name("%s-%d" % (name, i)) is not None:
+        i += 1
+    return "%s-%d" % (name, i)
+
+
+def create_one_by_one(directory, count, wad, cap):
+    for _ in range(count):
+        account = Account(probe_account_name(directory, "account"))
+        account.set_wad(wad)
+        account.set_cap(cap)
+        directory.add_account(account)
+
+
+def create_bulk(directory, count, wad, cap):
+    names = [directory.allocate_account_name("account") for _ in
+             range(count)]
+    for account_db in AccountDb.create_batch(names, wad, cap):
+        directory.add_account(Account(account_db.get_name(), db=account_db))
+
+
+def timed(func, store, count, wad, cap):
+    AccountDb.STORE = store
+    directory = TerminusDirectory()
+    start = time.perf_counter()
+    func(directory, count, wad, cap)
+    elapsed = time.perf_counter() - start
+    assert len(directory.get_account_list()) == count
+    return elapsed
+
+
+parser = argparse.ArgumentParser(prog="bench_bulkcreate")
+parser.add_argument("-n", "--count", type=int, default=2000,
+                    help="accounts to create with each variant")
+parser.add_argument("--backend", type=str, choices=["json", "sqlite"],
+                    default="json", help="storage backend to write to")
+settings = parser.parse_args()
+
+
+def make_store(directory):
+    if settings.backend == "sqlite":
+        return SqliteAccountStore(directory + "/terminus.sqlite")
+    return JsonAccountStore(directory)
+
+
+wad = Wad.bitcoin(5000000)
+cap = Wad.bitcoin(0)
+results = []
+for label, func in [("one by one", create_one_by_one),
+                    ("bulkcreate", create_bulk)]:
+    persist_dir = tempfile.mkdtemp(prefix="terminus-bench-")
+    try:
+        elapsed = timed(func, make_store(persist_dir), settings.count, wad,
+                        cap)
+    finally:
+        shutil.rmtree(persist_dir)
+    results.append((label, elapsed))
+
+print("%d accounts, %s backend" % (settings.count, settings.backend))
+for label, elapsed in results:
+    print("%-12s %8.2f s  %10.0f accounts/s" % (label, elapsed,
+                                                settings.count / elapsed))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Memory held by receipt entries read back from a journal: the column
+# backed ReceiptIndex against the previous index of one dict (and Wad) per
+# entry. Reports Python memory retained after loading, load time and the
+# time to page through the newest entries, which is where the new index
+# builds its dicts.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_receipt_memory
+#   $ python3 -m benchmarks.bench_receipt_memory -n 100000
+
+import gc
+import json
+import time
+import uuid
+import random
+import argparse
+import tracemalloc
+
+from moneysocket.wad.wad import Wad
+
+from terminus.receipts import ReceiptIndex
+
+
+class DictReceiptIndex(object):
+    """ The index as it was, an entry dict per receipt with its wad turned
+    back into a Wad on load. """
+    def __init__(self):
+        self.sessions = []
+        self.entries = []
+        self.times = []
+        self.positions_by_type = {}
+
+    def append(self, session_id, entry):
+        if 'wad' in entry:
+            entry['wad'] = Wad.from_dict(entry['wad'])
+        position = len(self.entries)
+        self.sessions.append(session_id)
+        self.entries.append(entry)
+        self.times.append(entry['time'])
+        if entry['type'] not in self.positions_by_type:
+            self.positions_by_type[entry['type']] = []
+        self.positions_by_type[entry['type']].append(position)
+
+    def query(self, limit):
+        end = len(self.entries)
+        return [(position, self.sessions[position], self.entries[position])
+                for position in range(end - 1, max(end - limit, 0) - 1, -1)]
+
+
+def session_entries(rng, now):
+    # one wallet session: a run of invoices and payments between start and
+    # end, roughly what a connected wallet leaves behind
+    yield {'type': "session_start", 'time': now}
+    for _ in range(rng.randrange(2, 40)):
+        msats = rng.randrange(1, 10 ** 8)
+        wad = Wad.bitcoin(msats)
+        bolt11 = "lnbc%dn1p%s" % (msats, "%0300x" % rng.getrandbits(1200))
+        preimage = "%064x" % rng.getrandbits(256)
+        if rng.random() < 0.5:
+            yield {'type': "invoice_request", 'time': now, 'wad': wad}
+            yield {'type': "invoice_notified", 'time': now, 'bolt11': bolt11}
+            yield {'type': "preimage_notified", 'time': now,
+                   'preimage': preimage, 'increment': True, 'wad': wad}
+        else:
+            yield {'type': "pay_request", 'time': now, 'wad': wad,
+                   'bolt11': bolt11}
+            if rng.random() < 0.05:
+                yield {'type': "error_notified", 'time': now,
+                       'error': "payment failed"}
+            else:
+                yield {'type': "preimage_notified", 'time': now,
+                       'preimage': preimage, 'increment': False, 'wad': wad}
+    yield {'type': "session_end", 'time': now}
+
+
+def journal_records(count, seed):
+    # (session id, entry) as read back from the journal, fresh objects for
+    # every entry the way json parsing leaves them
+    rng = random.Random(seed)
+    now = time.time() - count
+    n = 0
+    while True:
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        for entry in session_entries(rng, now + n):
+            if n == count:
+                return
+            line = json.dumps({'session': session_id, 'entry': entry})
+            record = json.loads(line)
+            yield record['session'], record['entry']
+            n += 1
+
+
+def measure(label, make_index, count, page, seed):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = make_index()
+    for session_id, entry in journal_records(count, seed):
+        index.append(session_id, entry)
+    load_seconds = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    if isinstance(index, ReceiptIndex):
+        rows, _ = index.query(limit=page)
+    else:
+        rows = index.query(page)
+    query_seconds = time.perf_counter() - start
+    assert len(rows) == min(page, count)
+    del index
+    print("%-8s %10.1f MiB  %6.1f B/entry  load %7.2f s  "
+          "page of %d %8.3f ms" % (label, retained / 2.0 ** 20,
+                                   retained / count, load_seconds, page,
+                                   query_seconds * 1000))
+
+
+parser = argparse.ArgumentParser(prog="bench_receipt_memory")
+parser.add_argument("-n", "--entries", type=int, default=1000000,
+                    help="receipt entries to load")
+parser.add_argument("-p", "--page", type=int, default=1000,
+                    help="entries per query page")
+parser.add_argument("-s", "--seed", type=int, default=0,
+                    help="seed of the generated receipts")
+settings = parser.parse_args()
+
+print("%d receipt entries, bolt11/preimage strings counted for both" %
+      settings.entries)
+for label, make_index in [("dicts", DictReceiptIndex),
+                          ("columns", ReceiptIndex)]:
+    measure(label, make_index, settings.entries, settings.page, settings.seed)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# RPC requests/sec against a local Twisted site, with the old per-request
+# argparse construction and pretty printing versus the dispatch table built
+# once by TerminusRpc.setup(). The app behind it is a stand-in that answers
+# every command with a fixed reply so only the RPC layer is measured.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_rpc
+
+import json
+import time
+import argparse
+
+from twisted.internet import reactor, defer
+from twisted.web import server
+from txjsonrpc.web.jsonrpc import Proxy
+
+from terminus.cmd_parse import TerminusCmdParse
+from terminus.rpc import TerminusRpc
+
+
+class FixedReplyApp(object):
+    def __getattr__(self, name):
+        def reply(args):
+            return {'success': True, 'name': "account-0",
+                    'accounts': [{'name': "account-%d" % i,
+                                  'wad': {'msats': i * 1000}} for i in
+                                 range(10)]}
+        return reply
+
+
+class LegacyTerminusRpc(TerminusRpc):
+    # the request handling as it was: a new parser tree per call
+    def exec_cmd(self, name, args, kwargs):
+        parser = TerminusCmdParse.get_parser(app=self.APP)
+        toparse = [name]
+        for a in args:
+            if isinstance(a, str):
+                toparse.extend(a)
+            elif isinstance(a, list):
+                toparse += a
+            elif isinstance(a, tuple):
+                for t in a:
+                    if isinstance(t, list):
+                        toparse += t
+                    else:
+                        toparse += [t]
+        parsed = parser.parse_args(toparse)
+        info = parsed.cmd_func(parsed)
+        return json.dumps(info, indent=1, sort_keys=True)
+
+
+@defer.inlineCallbacks
+def run_calls(url, n, concurrency, cmd, params):
+    proxy = Proxy(url)
+    sem = defer.DeferredSemaphore(concurrency)
+    start = time.perf_counter()
+    yield defer.gatherResults([sem.run(proxy.callRemote, cmd, params) for
+                               _ in range(n)])
+    return n / (time.perf_counter() - start)
+
+
+def time_in_process(rpc, n, cmd, params):
+    start = time.perf_counter()
+    for _ in range(n):
+        rpc.exec_cmd(cmd, (params,), {})
+    return n / (time.perf_counter() - start)
+
+
+@defer.inlineCallbacks
+def main(settings):
+    TerminusRpc.setup(FixedReplyApp(), compact=False)
+    results = []
+    for label, rpc_class, compact in [("before", LegacyTerminusRpc, False),
+                                      ("after", TerminusRpc, False),
+                                      ("after, compact", TerminusRpc, True)]:
+        TerminusRpc.COMPACT = compact
+        port = reactor.listenTCP(0, server.Site(rpc_class()),
+                                 interface="127.0.0.1")
+        url = "http://127.0.0.1:%d" % port.getHost().port
+        in_process = time_in_process(rpc_class(), settings.requests,
+                                     settings.command, settings.params)
+        over_http = yield run_calls(url, settings.requests,
+                                    settings.concurrency, settings.command,
+                                    settings.params)
+        yield port.stopListening()
+        results.append((label, in_process, over_http))
+    print("%d x %s %s, concurrency %d" % (settings.requests, settings.command,
+          " ".join(settings.params), settings.concurrency))
+    for label, in_process, over_http in results:
+        print("%-16s dispatch: %9.0f req/s   http: %7.0f req/s" % (
+              label, in_process, over_http))
+
+
+parser = argparse.ArgumentParser(prog="bench_rpc")
+parser.add_argument("-n", "--requests", type=int, default=2000,
+                    help="requests per variant")
+parser.add_argument("-c", "--concurrency", type=int, default=16,
+                    help="requests outstanding at once")
+parser.add_argument("--command", type=str, default="getaccountinfo",
+                    help="command to call")
+parser.add_argument("params", nargs="*", default=["account-0", "account-1"],
+                    help="command line words sent as the params")
+settings = parser.parse_args()
+
+d = main(settings)
+d.addErrback(lambda f: print(f.getTraceback()))
+d.addBoth(lambda _: reactor.stop())
+reactor.run()
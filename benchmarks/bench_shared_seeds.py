@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Per-request cost of collecting an account's shared seeds, decoding them
+# from their persisted strings every time versus the decoded copies kept by
+# AccountDb.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_shared_seeds
+
+import time
+import shutil
+import argparse
+import tempfile
+
+from moneysocket.beacon.beacon import MoneysocketBeacon
+from moneysocket.beacon.shared_seed import SharedSeed
+
+from terminus.account import Account
+from terminus.account_db import AccountDb
+from terminus.json_store import JsonAccountStore
+
+
+def decode_all_shared_seeds(account_db):
+    # what every hot path used to do via Account.get_all_shared_seeds()
+    shared_seeds = [SharedSeed.from_hex_string(ss) for ss in
+                    account_db.db['shared_seeds']]
+    beacons = [MoneysocketBeacon.from_bech32_str(b)[0] for b in
+               account_db.db['beacons']]
+    return shared_seeds + [b.get_shared_seed() for b in beacons]
+
+
+def timed(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+parser = argparse.ArgumentParser(prog="bench_shared_seeds")
+parser.add_argument("-i", "--iterations", type=int, default=10000,
+                    help="calls to time for each variant")
+parser.add_argument("-s", "--shared-seeds", type=int, default=3,
+                    help="listening shared seeds on the account")
+parser.add_argument("-b", "--beacons", type=int, default=3,
+                    help="outgoing beacons on the account")
+settings = parser.parse_args()
+
+persist_dir = tempfile.mkdtemp(prefix="terminus-bench-")
+try:
+    AccountDb.STORE = JsonAccountStore(persist_dir)
+    account = Account("bench")
+    for _ in range(settings.shared_seeds):
+        account.add_shared_seed(SharedSeed())
+    for _ in range(settings.beacons):
+        account.add_beacon(MoneysocketBeacon())
+    assert (decode_all_shared_seeds(account.db) ==
+            account.get_all_shared_seeds())
+
+    decoded = timed(lambda: decode_all_shared_seeds(account.db),
+                    settings.iterations)
+    cached = timed(account.get_all_shared_seeds, settings.iterations)
+    print("%d shared seeds, %d beacons, %d iterations" % (
+          settings.shared_seeds, settings.beacons, settings.iterations))
+    print("decode per call: %10.2f us" % (decoded * 1e6))
+    print("cached per call: %10.2f us" % (cached * 1e6))
+    print("saving per call: %10.2f us (%.0fx)" % (
+          (decoded - cached) * 1e6, decoded / cached))
+finally:
+    shutil.rmtree(persist_dir)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Cold start cost of loading every account: headers only, as the app does
+# now, versus also reading each account's receipts the way it used to, and
+# for the json backend from the directory snapshot. Reports time and peak
+# Python memory for each.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.bench_startup -n 1000 -r 1000
+
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+from moneysocket.wad.wad import Wad
+
+from terminus.account_db import AccountDb
+from terminus.json_store import JsonAccountStore
+from terminus.sqlite_store import SqliteAccountStore
+from terminus.snapshot import DirectorySnapshot
+
+
+def receipt_records(count):
+    session_id = str(uuid.uuid4())
+    now = time.time()
+    for i in range(count):
+        yield session_id, {'type': "invoice_request", 'time': now + i,
+                           'wad': Wad.bitcoin(1000 + i)}
+
+
+def load(read_receipts, snapshot=None):
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = None
+    if snapshot:
+        loaded = list(snapshot.load().values())
+    account_dbs = list(AccountDb.iter_account_dbs(loaded=loaded))
+    if read_receipts:
+        AccountDb.MAX_LOADED_RECEIPTS = len(account_dbs)
+        for account_db in account_dbs:
+            account_db.get_receipts()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    AccountDb.LOADED_RECEIPTS.clear()
+    return len(account_dbs), elapsed, peak
+
+
+parser = argparse.ArgumentParser(prog="bench_startup")
+parser.add_argument("-n", "--accounts", type=int, default=1000,
+                    help="accounts in the store")
+parser.add_argument("-r", "--receipts", type=int, default=1000,
+                    help="receipt entries per account")
+parser.add_argument("--backend", type=str, choices=["json", "sqlite"],
+                    default="json", help="storage backend")
+settings = parser.parse_args()
+
+persist_dir = tempfile.mkdtemp(prefix="terminus-bench-")
+try:
+    if settings.backend == "sqlite":
+        AccountDb.STORE = SqliteAccountStore(persist_dir + "/terminus.sqlite")
+    else:
+        AccountDb.STORE = JsonAccountStore(persist_dir)
+    names = ["account-%d" % i for i in range(settings.accounts)]
+    account_dbs = AccountDb.create_batch(names, Wad.bitcoin(10000000),
+                                         Wad.bitcoin(0))
+    for name in names:
+        AccountDb.STORE.replace_receipt_records(
+            name, list(receipt_records(settings.receipts)))
+
+    print("%d accounts with %d receipts each, %s backend" % (
+          settings.accounts, settings.receipts, settings.backend))
+    runs = [("with receipts", True, None), ("headers only", False, None)]
+    if settings.backend == "json":
+        snapshot = DirectorySnapshot(AccountDb.STORE, 0)
+        snapshot.reset(account_dbs)
+        snapshot.checkpoint()
+        runs.append(("snapshot", False, snapshot))
+    for label, read_receipts, snapshot in runs:
+        n, elapsed, peak = load(read_receipts, snapshot=snapshot)
+        print("%-14s %8.2f s  peak %8.1f MiB" % (label, elapsed,
+                                                 peak / 2.0 ** 20))
+finally:
+    shutil.rmtree(persist_dir)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Drives TerminusDirectory through randomized sequences of the delta
+# operations the app applies and checks the indexes against the account
+# state after every step, then times iter_accounts() on a large directory.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.check_directory
+
+import sys
+import time
+import random
+import argparse
+
+from terminus.directory import TerminusDirectory
+
+
+class SketchAccount(object):
+    # just the parts of Account the directory looks at
+    def __init__(self, name):
+        self.name = name
+        self.shared_seeds = []
+        self.pending = {}
+
+    def get_name(self):
+        return self.name
+
+    def get_all_shared_seeds(self):
+        return list(self.shared_seeds)
+
+    def get_pending(self):
+        return list(self.pending.items())
+
+
+def random_step(rng, directory, accounts, counter):
+    op = rng.choice(["create", "create", "rm", "add_seed", "add_seed",
+                     "remove_seed", "add_pending", "add_pending",
+                     "remove_pending", "reindex"])
+    if op == "create" or len(accounts) == 0:
+        account = SketchAccount("account-%d" % next(counter))
+        for _ in range(rng.randint(0, 2)):
+            account.shared_seeds.append("seed-%d" % next(counter))
+        accounts[account.get_name()] = account
+        directory.add_account(account)
+        return
+    account = accounts[rng.choice(sorted(accounts.keys()))]
+    if op == "rm":
+        directory.remove_account(account)
+        del accounts[account.get_name()]
+    elif op == "add_seed":
+        shared_seed = "seed-%d" % next(counter)
+        account.shared_seeds.append(shared_seed)
+        directory.add_shared_seed(account, shared_seed)
+    elif op == "remove_seed" and len(account.shared_seeds) > 0:
+        shared_seed = rng.choice(account.shared_seeds)
+        account.shared_seeds.remove(shared_seed)
+        directory.remove_shared_seed(account, shared_seed)
+    elif op == "add_pending":
+        payment_hash = "hash-%d" % next(counter)
+        account.pending[payment_hash] = "bolt11"
+        directory.add_pending(account, payment_hash)
+    elif op == "remove_pending" and len(account.pending) > 0:
+        payment_hash = rng.choice(sorted(account.pending.keys()))
+        del account.pending[payment_hash]
+        directory.remove_pending(account, payment_hash)
+    elif op == "reindex":
+        # untracked changes picked up by a reindex
+        account.shared_seeds = account.shared_seeds[1:]
+        account.pending["hash-%d" % next(counter)] = "bolt11"
+        directory.reindex_account(account)
+
+
+def counter_from(n):
+    while True:
+        yield n
+        n += 1
+
+
+parser = argparse.ArgumentParser(prog="check_directory")
+parser.add_argument("-r", "--runs", type=int, default=50,
+                    help="randomized operation sequences")
+parser.add_argument("-s", "--steps", type=int, default=500,
+                    help="operations per sequence")
+parser.add_argument("-a", "--accounts", type=int, default=100000,
+                    help="accounts for the iteration timing")
+parser.add_argument("--seed", type=int, default=0, help="random seed")
+settings = parser.parse_args()
+
+for run in range(settings.runs):
+    rng = random.Random(settings.seed + run)
+    directory = TerminusDirectory()
+    accounts = {}
+    counter = counter_from(0)
+    for step in range(settings.steps):
+        random_step(rng, directory, accounts, counter)
+        problems = directory.check_consistency()
+        if len(problems) > 0:
+            print("run %d step %d inconsistent:" % (run, step))
+            for problem in problems:
+                print("\t%s" % problem)
+            sys.exit(1)
+print("%d runs of %d steps: indexes consistent" % (settings.runs,
+                                                   settings.steps))
+
+directory = TerminusDirectory()
+for i in range(settings.accounts):
+    directory.add_account(SketchAccount("account-%d" % i))
+start = time.perf_counter()
+n = sum(1 for _ in directory.iter_accounts())
+elapsed = time.perf_counter() - start
+print("iter_accounts over %d accounts: %.2f ms" % (n, elapsed * 1000))
@@ -0,0 +1,206 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# A stand-in lightning node and provider stack for driving a TerminusApp
+# without a node or websocket peers. Invoices are plain strings instead of
+# signed bolt11 so that Bolt11 is patched to read them, which leaves the
+# cost of real bolt11 decoding out of the numbers.
+
+import os
+import time
+import random
+import threading
+from configparser import ConfigParser
+
+from twisted.internet.defer import Deferred
+
+from moneysocket.beacon.shared_seed import SharedSeed
+from moneysocket.utl.bolt11 import Bolt11
+from moneysocket.wad.wad import Wad
+
+from terminus.app import TerminusApp
+from terminus.account import Account
+from terminus.account_db import AccountDb
+
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "config", "terminus-cl.conf")
+
+INVOICE_EXPIRY = 3600
+
+
+def encode_invoice(payment_hash, msats, created_at=None):
+    created_at = int(time.time()) if created_at is None else created_at
+    return "lnfake:%s:%d:%d:%d" % (payment_hash, msats, created_at,
+                                   INVOICE_EXPIRY)
+
+
+def decode_invoice(bolt11):
+    _, payment_hash, msats, created_at, expiry = bolt11.split(":")
+    return {'payment_hash': payment_hash,
+            'msatoshi':     int(msats),
+            'created_at':   int(created_at),
+            'expiry':       int(expiry)}
+
+
+def patch_bolt11():
+    Bolt11.to_dict = staticmethod(decode_invoice)
+    Bolt11.get_msats = staticmethod(
+        lambda bolt11: decode_invoice(bolt11)['msatoshi'])
+    Bolt11.get_payment_hash = staticmethod(
+        lambda bolt11: decode_invoice(bolt11)['payment_hash'])
+
+
+class FakeLightning(object):
+    """ Answers get_invoice and pay_invoice after a fixed latency, failing a
+    given fraction of them. Called from the AsyncLightning pools, so it
+    blocks the way a real backend would. """
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.paid_recv_cb = None
+
+    def register_paid_recv_cb(self, cb):
+        self.paid_recv_cb = cb
+
+    def roll(self):
+        with self.lock:
+            preimage = "%064x" % self.random.getrandbits(256)
+            return preimage, self.random.random() < self.failure_rate
+
+    def new_invoice(self, msats):
+        # also used directly to set up pending invoices
+        preimage, _ = self.roll()
+        payment_hash = Bolt11.preimage_to_payment_hash(preimage)
+        return encode_invoice(payment_hash, msats), payment_hash, preimage
+
+    def get_invoice(self, msats):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        _, fail = self.roll()
+        if fail:
+            return None, "fake node: invoice failed"
+        bolt11, _, _ = self.new_invoice(msats)
+        return bolt11, None
+
+    def pay_invoice(self, bolt11, request_uuid):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        preimage, fail = self.roll()
+        if fail:
+            return None, None, "fake node: payment failed"
+        return preimage, decode_invoice(bolt11)['msatoshi'], None
+
+
+class FakeNexus(object):
+    def __init__(self, shared_seed):
+        self.shared_seed = shared_seed
+
+    def get_shared_seed(self):
+        return self.shared_seed
+
+
+class FakeProviderStack(object):
+    """ Takes the app's notifications and fires the Deferred of whoever
+    expects them, keyed by request uuid (or preimage for payments received
+    from the node, which have no request). """
+    def __init__(self):
+        self.expected = {}
+        self.notified = 0
+
+    def expect(self, key):
+        d = Deferred()
+        self.expected[key] = d
+        return d
+
+    def fire(self, key, outcome):
+        self.notified += 1
+        d = self.expected.pop(key, None)
+        if d:
+            d.callback(outcome)
+
+    def notify_invoice(self, shared_seeds, bolt11, request_uuid):
+        self.fire(request_uuid, "ok")
+
+    def notify_preimage(self, shared_seeds, preimage, request_uuid):
+        self.fire(request_uuid if request_uuid else preimage, "ok")
+
+    def notify_error(self, shared_seeds, error_msg,
+                     request_reference_uuid=None):
+        self.fire(request_reference_uuid, "error")
+
+    def get_listen_locations(self):
+        return []
+
+    def listen(self):
+        pass
+
+    def connect(self, location, shared_seed):
+        pass
+
+    def disconnect(self, shared_seed):
+        pass
+
+    def local_connect(self, shared_seed):
+        pass
+
+    def local_disconnect(self, shared_seed):
+        pass
+
+
+###############################################################################
+
+def make_config(persist_dir, backend="json", persist_interval=0.0,
+                max_inflight=8):
+    # the shipped config with all state under persist_dir
+    config = ConfigParser()
+    config.read(CONFIG_FILE)
+    config['App']['AccountPersistDir'] = persist_dir
+    config['App']['LogDir'] = persist_dir
+    config['App']['StorageBackend'] = backend
+    config['App']['SqlitePath'] = os.path.join(persist_dir,
+                                               "terminus.sqlite")
+    config['App']['PersistInterval'] = str(persist_interval)
+    config['App']['MaxInflightPayments'] = str(max_inflight)
+    config['App']['MaxInflightInvoices'] = str(max_inflight)
+    return config
+
+
+def make_app(persist_dir, backend="json", persist_interval=0.0,
+             latency=0.0, failure_rate=0.0, max_inflight=8):
+    patch_bolt11()
+    config = make_config(persist_dir, backend=backend,
+                         persist_interval=persist_interval,
+                         max_inflight=max_inflight)
+    node = FakeLightning(latency=latency, failure_rate=failure_rate)
+    app = TerminusApp(config, node)
+    app.provider_stack = FakeProviderStack()
+    return app, node
+
+
+def provision_accounts(app, count, msats):
+    """ count accounts with one listening shared seed each and an open
+    receipt session, as if every one of them had a connected wallet. """
+    names = [app.directory.allocate_account_name("bench") for _ in
+             range(count)]
+    accounts = []
+    for account_db in AccountDb.create_batch(names, Wad.bitcoin(msats),
+                                             Wad.bitcoin(0)):
+        account = Account(account_db.get_name(), db=account_db)
+        shared_seed = SharedSeed()
+        account.add_shared_seed(shared_seed)
+        app.directory.add_account(account)
+        account.new_session(shared_seed)
+        accounts.append((account, shared_seed))
+    return accounts
+
+
+def dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# A full terminus (RPC, websocket listener, persistence) with the fake
+# lightning node behind it, as the server for benchmarks.load_consumers.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.fake_terminus -c terminus.conf --latency 20
+
+import os
+import sys
+import logging
+import argparse
+from configparser import ConfigParser
+
+from twisted.internet import reactor
+
+from terminus.app import TerminusApp
+from benchmarks.fake_node import FakeLightning, patch_bolt11
+
+
+parser = argparse.ArgumentParser(prog="fake_terminus")
+parser.add_argument("-c", "--config", type=str, required=True,
+                    help="terminus config file")
+parser.add_argument("--latency", type=float, default=0.0,
+                    help="fake node milliseconds per call")
+parser.add_argument("--failure-rate", type=float, default=0.0,
+                    help="fraction of fake node calls that fail")
+settings = parser.parse_args()
+
+if not os.path.exists(settings.config):
+    sys.exit("*** can't use config: %s" % settings.config)
+
+config = ConfigParser()
+config.read(settings.config)
+
+logging.basicConfig(level=logging.WARNING)
+patch_bolt11()
+node = FakeLightning(latency=settings.latency / 1000.0,
+                     failure_rate=settings.failure_rate)
+app = TerminusApp(config, node)
+app.run_app()
+
+reactor.run()
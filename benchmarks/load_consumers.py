@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# Load generator for the websocket listener: starts a terminus on the fake
+# lightning node (benchmarks.fake_terminus), creates accounts and listening
+# beacons over RPC, then opens N Moneysocket consumer connections to the
+# local listener. Every consumer sends invoice and pay requests at a set
+# rate. Provider info is requested by the consumer layer itself while a
+# connection is up, those replies are counted as they come in.
+#
+# Reports connection setup time, request latency per kind, and the server's
+# CPU and memory from /proc while under load. Everything runs on localhost.
+# For more consumers than one generator process can drive, run several
+# with different --prefix against a server started with --no-spawn.
+#
+# run from the repository root:
+#   $ python3 -m benchmarks.load_consumers -n 200 --rate 1 --duration 30
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+
+from twisted.internet import reactor, defer, task, protocol
+from txjsonrpc.web.jsonrpc import Proxy
+
+from moneysocket.beacon.beacon import MoneysocketBeacon
+from moneysocket.stack.outgoing_consumer import OutgoingConsumerStack
+
+from benchmarks.fake_node import make_config, encode_invoice
+
+
+REQUEST_KINDS = ["invoice", "pay"]
+ACCOUNT_MSATS = 10 ** 15
+OP_MSATS = 1000
+SERVER_START_TIMEOUT = 30.0
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def percentiles(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return "n/a"
+    def p(q):
+        return values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return "p50 %7.2f  p90 %7.2f  p99 %7.2f  max %7.2f ms" % (
+        p(0.50), p(0.90), p(0.99), values[-1] * 1000)
+
+
+###############################################################################
+
+class ProcessStats(object):
+    """ CPU time and resident memory of another process, from /proc. """
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.peak_rss = 0
+        self.loop = task.LoopingCall(self.sample)
+
+    def cpu_seconds(self):
+        with open("/proc/%d/stat" % self.pid) as f:
+            # the command name can hold spaces, the fields follow its ')'
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def rss_bytes(self):
+        with open("/proc/%d/statm" % self.pid) as f:
+            return int(f.read().split()[1]) * self.page_size
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self.rss_bytes())
+
+    def start(self):
+        self.wall = time.monotonic()
+        self.cpu = self.cpu_seconds()
+        self.loop.start(1.0)
+
+    def stop(self):
+        self.loop.stop()
+        wall = time.monotonic() - self.wall
+        return (100.0 * (self.cpu_seconds() - self.cpu) / wall,
+                self.rss_bytes(), self.peak_rss)
+
+
+###############################################################################
+
+class Consumer(object):
+    def __init__(self, stats, beacon, rate, rng):
+        self.stats = stats
+        self.beacon = beacon
+        self.rate = rate
+        self.random = rng
+        self.pending = {}
+        self.connect_started = None
+        self.connected = False
+        self.loop = task.LoopingCall(self.send_request)
+        self.stack = OutgoingConsumerStack()
+        self.stack.onannounce = self.on_announce
+        self.stack.onrevoke = self.on_revoke
+        self.stack.onproviderinfo = self.on_provider_info
+        self.stack.oninvoice = self.on_invoice
+        self.stack.onpreimage = self.on_preimage
+        self.stack.onerror = self.on_error
+        self.stack.onstackevent = lambda *args: None
+        self.stack.onping = lambda *args: None
+
+    def connect(self):
+        self.connect_started = time.perf_counter()
+        location = self.beacon.locations[0]
+        self.stack.do_connect(location, self.beacon.shared_seed)
+
+    def disconnect(self):
+        if self.loop.running:
+            self.loop.stop()
+        self.stack.do_disconnect()
+
+    ###########################################################################
+
+    def on_announce(self, nexus):
+        self.connected = True
+        self.stats.connect_times.append(time.perf_counter() -
+                                        self.connect_started)
+        # spread the first requests out over one period
+        reactor.callLater(self.random.uniform(0, 1.0 / self.rate),
+                          self.loop.start, 1.0 / self.rate)
+
+    def on_revoke(self, nexus):
+        if self.connected:
+            self.stats.revokes += 1
+        self.connected = False
+        if self.loop.running:
+            self.loop.stop()
+
+    def on_provider_info(self, nexus, provider_info):
+        self.stats.provider_infos += 1
+
+    ###########################################################################
+
+    def send_request(self):
+        kind = self.random.choice(self.stats.kinds)
+        request_uuid = str(uuid.uuid4())
+        self.pending[request_uuid] = (kind, time.perf_counter())
+        if kind == "invoice":
+            self.stack.request_invoice(OP_MSATS, request_uuid, "")
+        else:
+            bolt11 = encode_invoice("%064x" % self.random.getrandbits(256),
+                                    OP_MSATS)
+            self.stack.request_pay(bolt11, request_uuid)
+
+    def finish(self, request_uuid, ok):
+        if request_uuid not in self.pending:
+            return
+        kind, started = self.pending.pop(request_uuid)
+        self.stats.record(kind, time.perf_counter() - started, ok)
+
+    def on_invoice(self, nexus, bolt11, request_reference_uuid):
+        self.finish(request_reference_uuid, True)
+
+    def on_preimage(self, nexus, preimage, request_reference_uuid):
+        self.finish(request_reference_uuid, True)
+
+    def on_error(self, nexus, error_msg, request_reference_uuid):
+        self.finish(request_reference_uuid, False)
+
+
+class LoadStats(object):
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.connect_times = []
+        self.latencies = {kind: [] for kind in kinds}
+        self.errors = {kind: 0 for kind in kinds}
+        self.provider_infos = 0
+        self.revokes = 0
+        self.recording = False
+
+    def record(self, kind, seconds, ok):
+        if not self.recording:
+            return
+        if ok:
+            self.latencies[kind].append(seconds)
+        else:
+            self.errors[kind] += 1
+
+
+###############################################################################
+
+def spawn_server(settings, work_dir):
+    rpc_port = free_port()
+    listen_port = free_port()
+    config = make_config(work_dir, backend=settings.backend,
+                         max_inflight=settings.max_inflight)
+    config['Listen']['BindPort'] = str(listen_port)
+    config['Listen']['ExternalPort'] = str(listen_port)
+    config['Listen']['UseTLS'] = "False"
+    config['Rpc']['BindPort'] = str(rpc_port)
+    config['Rpc']['ExternalPort'] = str(rpc_port)
+    config['Rpc']['CompactResponses'] = "True"
+    config_file = os.path.join(work_dir, "terminus.conf")
+    with open(config_file, "w") as f:
+        config.write(f)
+    args = [sys.executable, "-m", "benchmarks.fake_terminus",
+            "-c", config_file, "--latency", str(settings.latency),
+            "--failure-rate", str(settings.failure_rate)]
+    # the server's output goes straight to ours
+    process = reactor.spawnProcess(
+        protocol.ProcessProtocol(), sys.executable, args, env=os.environ,
+        path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        childFDs={0: "w", 1: 1, 2: 2})
+    return process, "http://127.0.0.1:%d" % rpc_port
+
+
+@defer.inlineCallbacks
+def wait_for_rpc(proxy):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            yield proxy.callRemote("getinfo", [])
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            yield task.deferLater(reactor, 0.2, lambda: None)
+
+
+@defer.inlineCallbacks
+def call(proxy, cmd, words):
+    info = json.loads((yield proxy.callRemote(cmd, words)))
+    if not info['success']:
+        raise Exception("%s failed: %s" % (cmd, info['error']))
+    return info
+
+
+@defer.inlineCallbacks
+def setup_beacons(proxy, settings):
+    start = time.perf_counter()
+    created = yield call(proxy, "bulkcreate",
+                         [str(settings.consumers), str(ACCOUNT_MSATS),
+                          "-a", settings.prefix])
+    beacons = []
+    sem = defer.DeferredSemaphore(16)
+    results = yield defer.gatherResults(
+        [sem.run(call, proxy, "listen", [name]) for name in
+         created['names']])
+    for info in results:
+        beacons.append(MoneysocketBeacon.from_bech32_str(info['beacon'])[0])
+    print("%d accounts and beacons set up over RPC in %.2fs" % (
+          len(beacons), time.perf_counter() - start))
+    return beacons
+
+
+@defer.inlineCallbacks
+def connect_all(consumers, settings):
+    start = time.perf_counter()
+    for consumer in consumers:
+        consumer.connect()
+        if settings.connect_rate > 0:
+            yield task.deferLater(reactor, 1.0 / settings.connect_rate,
+                                  lambda: None)
+    deadline = time.monotonic() + settings.connect_timeout
+    while (sum(1 for c in consumers if c.connected) < len(consumers) and
+           time.monotonic() < deadline):
+        yield task.deferLater(reactor, 0.1, lambda: None)
+    return time.perf_counter() - start
+
+
+@defer.inlineCallbacks
+def main(settings):
+    work_dir = tempfile.mkdtemp(prefix="terminus-load-")
+    process = None
+    try:
+        if settings.no_spawn:
+            url = settings.url
+            pid = settings.pid
+        else:
+            process, url = spawn_server(settings, work_dir)
+            pid = process.pid
+        proxy = Proxy(url)
+        yield wait_for_rpc(proxy)
+
+        beacons = yield setup_beacons(proxy, settings)
+        stats = LoadStats(settings.kinds)
+        rng = random.Random(settings.seed)
+        consumers = [Consumer(stats, beacon, settings.rate,
+                              random.Random(rng.random())) for beacon in
+                     beacons]
+
+        connect_seconds = yield connect_all(consumers, settings)
+        connected = sum(1 for c in consumers if c.connected)
+        print("%d/%d consumers connected in %.2fs" % (
+              connected, len(consumers), connect_seconds))
+        print("  connection setup: %s" % percentiles(stats.connect_times))
+
+        server = ProcessStats(pid) if pid else None
+        if server:
+            server.start()
+        stats.recording = True
+        yield task.deferLater(reactor, settings.duration, lambda: None)
+        stats.recording = False
+
+        total = sum(len(v) for v in stats.latencies.values())
+        print("%.0fs of load, %.1f requests/s answered, %d provider infos, "
+              "%d revoked" % (settings.duration, total / settings.duration,
+                              stats.provider_infos, stats.revokes))
+        for kind in settings.kinds:
+            print("  %-8s %6d ok %5d err  %s" % (
+                  kind, len(stats.latencies[kind]), stats.errors[kind],
+                  percentiles(stats.latencies[kind])))
+        if server:
+            cpu, rss, peak_rss = server.stop()
+            print("server pid %d: cpu %.1f%%  rss %.1f MiB  peak %.1f MiB" % (
+                  pid, cpu, rss / 2.0 ** 20, peak_rss / 2.0 ** 20))
+
+        for consumer in consumers:
+            consumer.disconnect()
+    finally:
+        if process:
+            process.signalProcess("TERM")
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+parser = argparse.ArgumentParser(prog="load_consumers")
+parser.add_argument("-n", "--consumers", type=int, default=100,
+                    help="consumer connections to open")
+parser.add_argument("-r", "--rate", type=float, default=1.0,
+                    help="requests per second per consumer")
+parser.add_argument("-d", "--duration", type=float, default=30.0,
+                    help="seconds of load after everybody connected")
+parser.add_argument("-k", "--kinds", type=str,
+                    default=",".join(REQUEST_KINDS),
+                    help="comma separated request kinds to mix, of: %s" %
+                         ", ".join(REQUEST_KINDS))
+parser.add_argument("--connect-rate", type=float, default=50.0,
+                    help="new connections per second, 0 for all at once")
+parser.add_argument("--connect-timeout", type=float, default=60.0,
+                    help="seconds to wait for all consumers to connect")
+parser.add_argument("--prefix", type=str, default="load",
+                    help="account name prefix")
+parser.add_argument("--seed", type=int, default=0, help="random seed")
+parser.add_argument("--backend", type=str, choices=["json", "sqlite"],
+                    default="json", help="storage backend of the server")
+parser.add_argument("--latency", type=float, default=0.0,
+                    help="fake node milliseconds per call")
+parser.add_argument("--failure-rate", type=float, default=0.0,
+                    help="fraction of fake node calls that fail")
+parser.add_argument("--max-inflight", type=int, default=8,
+                    help="MaxInflightPayments and MaxInflightInvoices")
+parser.add_argument("--no-spawn", action="store_true",
+                    help="use an already running benchmarks.fake_terminus "
+                         "at --url")
+parser.add_argument("--url", type=str, default="http://127.0.0.1:11054",
+                    help="RPC url of the server with --no-spawn")
+parser.add_argument("--pid", type=int, default=None,
+                    help="server pid for cpu/memory with --no-spawn")
+settings = parser.parse_args()
+settings.kinds = settings.kinds.split(",")
+for kind in settings.kinds:
+    if kind not in REQUEST_KINDS:
+        parser.error("unknown request kind: %s" % kind)
+
+d = main(settings)
+d.addErrback(lambda f: print(f.getTraceback()))
+d.addBoth(lambda _: reactor.stop())
+reactor.run()
@@ -2,23 +2,35 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
+import uuid
 import logging
 
 from moneysocket.beacon.beacon import MoneysocketBeacon
-from moneysocket.utl.bolt11 import Bolt11
 from moneysocket.wad.wad import Wad
 
 from terminus.account_db import AccountDb
 from terminus.receipts import SocketSessionReceipt
+from terminus.bolt11_cache import BOLT11_CACHE
 
 class Account(object):
     def __init__(self, name, db=None):
         self.connection_attempts = {}
         self.db = db if db else AccountDb(name)
+        # msats held back for payments that are still in flight, not
+        # persisted since an outstanding payment doesn't survive a restart
+        self.reservations = {}
+        self.reserved_msats = 0
+        # likewise for invoices the node hasn't handed back yet
+        self.incoming_reservations = {}
+        self.incoming_reserved_msats = 0
+        # attributes snapshot for getinfo, dropped whenever something in it
+        # changes and rebuilt on the next call
+        self.attributes = None
+        self.attributes_locations = None
 
     @staticmethod
-    def iter_persisted_accounts():
-        for account_db in AccountDb.iter_account_dbs():
+    def iter_persisted_accounts(loaded=None):
+        for account_db in AccountDb.iter_account_dbs(loaded=loaded):
             yield Account(account_db.get_name(), db=account_db)
 
     def depersist(self):
@@ -28,8 +40,7 @@ class Account(object):
 
     def iter_summary_lines(self, locations):
         yield "\t%s: wad: %s " % (self.db.get_name(), self.db.get_wad())
-        for beacon in self.db.get_beacons():
-            beacon_str = beacon.to_bech32_str()
+        for beacon_str, _ in self.db.iter_beacon_strs():
             yield "\t\toutgoing beacon: %s" % beacon_str
             ca = (self.connection_attempts[beacon_str] if beacon_str in
                   self.connection_attempts else "(none)")
@@ -44,11 +55,11 @@ class Account(object):
     def summary_string(self, locations):
         return "\n".join(self.iter_summary_lines(locations))
 
-    def get_attributes(self, locations):
-        outgoing_beacons = []
-        for beacon in self.db.get_beacons():
-            beacon_str = beacon.to_bech32_str()
-            outgoing_beacons.append(beacon_str)
+    def invalidate_attributes(self):
+        self.attributes = None
+
+    def build_attributes(self, locations):
+        outgoing_beacons = [b for b, _ in self.db.iter_beacon_strs()]
         incoming_beacons = []
         for shared_seed in self.db.get_shared_seeds():
             beacon = MoneysocketBeacon(shared_seed)
@@ -56,37 +67,52 @@ class Account(object):
                 beacon.add_location(location)
             beacon_str = beacon.to_bech32_str()
             incoming_beacons.append(beacon_str)
-        connection_attempts = {b: str(ca) for b, ca in
-                               self.connection_attempts.items()}
         info = {'name':                self.db.get_name(),
                 'wad':                 self.db.get_wad(),
                 'cap':                 self.db.get_cap(),
                 'outgoing_beacons':    outgoing_beacons,
-                'incoming_beacons':    incoming_beacons,
-                'connection_attempts': connection_attempts}
+                'incoming_beacons':    incoming_beacons}
+        return info
+
+    def get_attributes(self, locations):
+        locations_key = tuple(str(location) for location in locations)
+        if (self.attributes is None or
+                self.attributes_locations != locations_key):
+            self.attributes = self.build_attributes(locations)
+            self.attributes_locations = locations_key
+        info = dict(self.attributes)
+        # the attempts change state on their own, describing them is cheap
+        info['connection_attempts'] = {b: str(ca) for b, ca in
+                                       self.connection_attempts.items()}
         return info
 
 
     ##########################################################################
 
     def add_connection_attempt(self, beacon, connection_attempt):
-        beacon_str = beacon.to_bech32_str()
+        beacon_str = self.db.get_beacon_str(beacon)
         self.connection_attempts[beacon_str] = connection_attempt
+        self.invalidate_attributes()
 
     ##########################################################################
 
     def add_beacon(self, beacon):
         self.db.add_beacon(beacon)
+        self.invalidate_attributes()
 
     def remove_beacon(self, beacon):
+        beacon_str = self.db.get_beacon_str(beacon)
         self.db.remove_beacon(beacon)
-        _ = self.connection_attempts.pop(beacon.to_bech32_str(), None)
+        _ = self.connection_attempts.pop(beacon_str, None)
+        self.invalidate_attributes()
 
     def add_shared_seed(self, shared_seed):
         self.db.add_shared_seed(shared_seed)
+        self.invalidate_attributes()
 
     def remove_shared_seed(self, shared_seed):
         self.db.remove_shared_seed(shared_seed)
+        self.invalidate_attributes()
 
     def add_pending(self, payment_hash, bolt11):
         self.db.add_pending(payment_hash, bolt11)
@@ -94,16 +120,21 @@ class Account(object):
     def remove_pending(self, payment_hash):
         self.db.remove_pending(payment_hash)
 
-    def prune_expired_pending(self):
-        self.db.prune_expired_pending()
+    def has_pending(self, payment_hash):
+        return self.db.has_pending(payment_hash)
+
+    def get_pending_expiry(self, payment_hash):
+        return self.db.get_pending_expiry(payment_hash)
 
     ##########################################################################
 
     def set_wad(self, wad):
         self.db.set_wad(wad)
+        self.invalidate_attributes()
 
     def set_cap(self, wad):
         self.db.set_cap(wad)
+        self.invalidate_attributes()
 
     def get_wad(self):
         return self.db.get_wad()
@@ -113,9 +144,46 @@ class Account(object):
 
     def add_wad(self, wad):
         self.db.add_wad(wad)
+        self.invalidate_attributes()
 
     def subtract_wad(self, wad):
         self.db.subtract_wad(wad)
+        self.invalidate_attributes()
+
+    def get_available_msats(self):
+        return self.db.get_wad()['msats'] - self.reserved_msats
+
+    ##########################################################################
+
+    def reserve(self, msats):
+        reservation = str(uuid.uuid4())
+        self.reservations[reservation] = msats
+        self.reserved_msats += msats
+        return reservation
+
+    def release(self, reservation):
+        msats = self.reservations.pop(reservation, None)
+        if msats is not None:
+            self.reserved_msats -= msats
+
+    def has_reservations(self):
+        return (len(self.reservations) > 0 or
+                len(self.incoming_reservations) > 0)
+
+    def reserve_incoming(self, msats):
+        reservation = str(uuid.uuid4())
+        self.incoming_reservations[reservation] = msats
+        self.incoming_reserved_msats += msats
+        return reservation
+
+    def release_incoming(self, reservation):
+        msats = self.incoming_reservations.pop(reservation, None)
+        if msats is not None:
+            self.incoming_reserved_msats -= msats
+
+    def get_incoming_msats(self):
+        # outstanding invoices plus the ones still being generated
+        return self.db.get_pending_msats() + self.incoming_reserved_msats
 
     ##########################################################################
 
@@ -134,21 +202,23 @@ class Account(object):
 
     def get_all_shared_seeds(self):
         # the shared seeds for both listening and outgoing
-        return (self.get_shared_seeds() +
-                [b.get_shared_seed() for b in self.get_beacons()])
+        return self.db.get_all_shared_seeds()
 
+    def get_beacon_shared_seeds(self):
+        return self.db.get_beacon_shared_seeds()
 
-    def get_disconnected_beacons(self):
-        dbs = []
-        for beacon in self.get_beacons():
-            beacon_str = beacon.to_bech32_str()
-            if beacon_str not in self.connection_attempts:
-                continue
-            state = self.connection_attempts[beacon_str].get_state()
-            if state != "disconnected":
-                continue
-            dbs.append(beacon)
-        return dbs
+
+    def get_beacon_by_seed(self, shared_seed):
+        for beacon in self.db.iter_beacons():
+            if beacon.get_shared_seed() == shared_seed:
+                return beacon
+        return None
+
+    def get_connection_state(self, beacon):
+        beacon_str = self.db.get_beacon_str(beacon)
+        if beacon_str not in self.connection_attempts:
+            return "disconnected"
+        return self.connection_attempts[beacon_str].get_state()
 
 
     def get_provider_info(self):
@@ -160,8 +230,13 @@ class Account(object):
 
     ##########################################################################
 
-    def get_receipts(self):
-        return self.db.get_receipts()
+    def query_receipts(self, cursor=None, limit=100, since=None, until=None,
+                       entry_types=None):
+        return self.db.query_receipts(cursor=cursor, limit=limit, since=since,
+                                      until=until, entry_types=entry_types)
+
+    def archive_receipts(self, live_entries, max_age):
+        return self.db.archive_receipts(live_entries, max_age)
 
     def new_session(self, shared_seed):
         self.db.new_receipt_session(shared_seed)
@@ -174,7 +249,7 @@ class Account(object):
         self.db.add_receipt_entry(shared_seed, entry)
 
     def session_pay_requested(self, shared_seed, bolt11):
-        msats = Bolt11.get_msats(bolt11)
+        msats = BOLT11_CACHE.get_msats(bolt11)
         wad = Wad.bitcoin(msats)
         entry = SocketSessionReceipt.pay_request_entry(bolt11, wad)
         self.db.add_receipt_entry(shared_seed, entry)
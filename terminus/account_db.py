@@ -3,131 +3,294 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
-import os
-import json
+import copy
+import time
 import logging
 import uuid
-import time
+from collections import OrderedDict
+
+from twisted.internet.defer import succeed
 
 from moneysocket.beacon.beacon import MoneysocketBeacon
 from moneysocket.beacon.shared_seed import SharedSeed
 
-from moneysocket.utl.bolt11 import Bolt11
 from moneysocket.wad.wad import Wad
 
+from terminus.json_store import legacy_receipt_records
+from terminus.metrics import (Timer, PERSIST_SECONDS, PERSIST_BYTES,
+                              PERSIST_ACCOUNTS)
+from terminus.receipts import ReceiptIndex
+from terminus.bolt11_cache import BOLT11_CACHE
+
 
 EMPTY_DB = {'account_name':  "",
             'account_uuid':  "",
             'wad':           None,
             'cap':           None,
             'pending':       {},
+            'pending_expiry': {},
+            'pending_msats': {},
             'shared_seeds':  [],
-            'beacons':       [],
-            'receipts':      []}
+            'beacons':       []}
 
 class AccountDb(object):
-    PERSIST_DIR = None
-
-    def __init__(self, account_name):
+    STORE = None
+    PERSIST_QUEUE = None
+    SNAPSHOT = None
+    ARCHIVE = None
+    # account dbs with their receipt index in memory, least recently used
+    # first
+    LOADED_RECEIPTS = OrderedDict()
+    MAX_LOADED_RECEIPTS = 64
+
+    def __init__(self, account_name, record=None, seeds=None):
         self.account_name = account_name
-        AccountDb._make_dirs_exist(AccountDb.PERSIST_DIR)
-
-        self.filename = os.path.join(AccountDb.PERSIST_DIR,
-                                     "%s.json" % account_name)
-        self.make_exist(self.filename)
-        logging.info("using account db: %s" % self.filename)
-        self.db = self.read_json(self.filename)
+        self.header_dirty = False
+        self.receipt_appends = []
+        self.db = record if record else self.make_exist()
         self.db['wad'] = Wad.from_dict(self.db['wad'])
         self.db['cap'] = Wad.from_dict(self.db['cap'])
-        for session in self.db['receipts']:
-            for entry in session:
-                if 'wad' in entry:
-                    entry['wad'] = Wad.from_dict(entry['wad'])
+        # receipts used to live in the account file, move them out to the
+        # append-only journal
+        legacy_receipts = self.db.pop('receipts', None)
+        if legacy_receipts is not None:
+            self.migrate_receipts(legacy_receipts)
+        # read from the store on first use rather than at startup, see
+        # get_receipts()
+        self.receipts = None
         self.session_index = {}
+        # decoded once here and kept in step with the persisted strings by
+        # the add/remove methods so the hot paths never touch bech32
+        self.shared_seeds = [SharedSeed.from_hex_string(ss) for ss in
+                             self.db['shared_seeds']]
+        self.beacons = None
+        self.all_shared_seeds = None
+        if seeds is not None and len(seeds) == (len(self.db['shared_seeds']) +
+                                                len(self.db['beacons'])):
+            # the seeds as kept by the directory snapshot, the outgoing
+            # beacons are left to decode when first needed
+            self.all_shared_seeds = self.shared_seeds + [
+                SharedSeed.from_hex_string(ss) for ss in
+                seeds[len(self.shared_seeds):]]
+        else:
+            self.update_all_shared_seeds()
+        # expiry and amount are worked out once per invoice, records from
+        # before they were kept get them filled in here
+        for key in ('pending_expiry', 'pending_msats'):
+            if key not in self.db:
+                self.db[key] = {}
+        unknown = [(payment_hash, bolt11) for payment_hash, bolt11 in
+                   self.db['pending'].items() if
+                   payment_hash not in self.db['pending_expiry'] or
+                   payment_hash not in self.db['pending_msats']]
+        for payment_hash, bolt11 in unknown:
+            self.set_pending_info(payment_hash, bolt11)
+        if len(unknown) > 0:
+            self.persist()
+        self.pending_msats = sum(self.db['pending_msats'].values())
 
     ###########################################################################
 
     @staticmethod
-    def _make_dirs_exist(dir_path):
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
+    def iter_account_dbs(loaded=None):
+        # from the store unless read from a snapshot, which gives (record,
+        # shared seed hex strings) pairs
+        if loaded is None:
+            loaded = ((record, None) for record in
+                      AccountDb.STORE.iter_account_records())
+        for record, seeds in loaded:
+            yield AccountDb(record['account_name'], record=record,
+                            seeds=seeds)
 
     @staticmethod
-    def iter_account_dbs():
-        if not os.path.exists(AccountDb.PERSIST_DIR):
-            return
-        for f in os.listdir(AccountDb.PERSIST_DIR):
-            path = os.path.join(AccountDb.PERSIST_DIR, f)
-            if path.endswith(".json"):
-                account_name = f[:-5]
-                yield AccountDb(account_name)
-
-    ###########################################################################
+    def new_record(account_name, wad=None, cap=None):
+        record = copy.deepcopy(EMPTY_DB)
+        record['account_name'] = account_name
+        record['account_uuid'] = str(uuid.uuid4())
+        record['wad'] = wad
+        record['cap'] = cap
+        return record
 
+    @staticmethod
+    def create_batch(account_names, wad, cap):
+        # many fresh accounts written to the store together rather than a
+        # file (or transaction) each plus separate wad and cap writes
+        account_dbs = [AccountDb(name, record=AccountDb.new_record(
+                                     name, wad=wad, cap=cap))
+                       for name in account_names]
+        for account_db in account_dbs:
+            account_db.header_dirty = True
+        if AccountDb.PERSIST_QUEUE:
+            for account_db in account_dbs:
+                AccountDb.PERSIST_QUEUE.mark_dirty(account_db)
+        else:
+            AccountDb.write_batch(account_dbs)
+        return account_dbs
 
-    def make_exist(self, filename):
-        if os.path.exists(filename):
-            return
-        logging.info("initializing new persitence db: %s" % self.filename)
-        dir_path = os.path.dirname(filename)
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-        record = EMPTY_DB.copy()
-        record['account_name'] = self.account_name
-        record['account_uuid'] = str(uuid.uuid4())
-        self.write_json(filename, record)
+    @staticmethod
+    def barrier():
+        if not AccountDb.PERSIST_QUEUE:
+            return succeed(None)
+        return AccountDb.PERSIST_QUEUE.barrier()
 
-    def write_file(self, path, content):
-        f = open(path, 'w')
-        f.write(content)
-        f.close()
+    @staticmethod
+    def write_batch(account_dbs):
+        timer = Timer()
+        changes = [(a.account_name, a.db if a.header_dirty else None,
+                    a.receipt_appends) for a in account_dbs]
+        if AccountDb.SNAPSHOT:
+            AccountDb.SNAPSHOT.record_batch(
+                [a for a in account_dbs if a.header_dirty])
+        by_name = {a.account_name: a for a in account_dbs}
+        def appended(account_name):
+            # on disk, a retry of the batch mustn't append them again
+            by_name[account_name].receipt_appends = []
+        written = AccountDb.STORE.commit(changes, appended_cb=appended)
+        if AccountDb.SNAPSHOT:
+            AccountDb.SNAPSHOT.batch_committed()
+        timer.observe(PERSIST_SECONDS)
+        PERSIST_BYTES.inc(amount=written)
+        PERSIST_ACCOUNTS.observe(len(account_dbs))
+        for account_db in account_dbs:
+            account_db.header_dirty = False
 
-    def write_json(self, path, info, quick=True):
-        content = (json.dumps(info) if quick else
-                   json.dumps(info, indent=1, sort_keys=True))
-        self.write_file(path, content)
+    ###########################################################################
 
-    def read_json(self, path):
-        f = open(path, 'r')
-        c = f.read()
-        info = json.loads(c)
-        f.close()
-        return info
+    def make_exist(self):
+        if AccountDb.STORE.has_account(self.account_name):
+            logging.info("using account db: %s in %s" % (self.account_name,
+                                                         AccountDb.STORE))
+            return AccountDb.STORE.read_account(self.account_name)
+        logging.info("initializing new persistence db: %s in %s" % (
+            self.account_name, AccountDb.STORE))
+        record = AccountDb.new_record(self.account_name)
+        AccountDb.STORE.create_account(record)
+        return record
 
     def persist(self):
-        self.write_json(self.filename, self.db)
+        self.header_dirty = True
+        self.queue_persist()
+
+    def queue_persist(self):
+        if AccountDb.PERSIST_QUEUE:
+            AccountDb.PERSIST_QUEUE.mark_dirty(self)
+        else:
+            AccountDb.write_batch([self])
 
     def depersist(self):
-        os.remove(self.filename)
+        if AccountDb.PERSIST_QUEUE:
+            AccountDb.PERSIST_QUEUE.discard(self)
+        self.header_dirty = False
+        self.receipt_appends = []
+        _ = AccountDb.LOADED_RECEIPTS.pop(self, None)
+        self.receipts = None
+        if AccountDb.SNAPSHOT:
+            AccountDb.SNAPSHOT.record_remove(self.account_name)
+        AccountDb.STORE.remove_account(self.account_name)
+        if AccountDb.ARCHIVE:
+            AccountDb.ARCHIVE.remove_account(self.account_name)
+
+    ###########################################################################
+
+    def get_receipts(self):
+        # the store has everything flushed, receipt_appends the rest. Only a
+        # bounded number of accounts keep their index loaded, the least
+        # recently used drop theirs.
+        if self.receipts is None:
+            self.receipts = self.read_receipts()
+            for session_id, entry in self.receipt_appends:
+                self.receipts.append(session_id, entry)
+        loaded = AccountDb.LOADED_RECEIPTS
+        loaded[self] = None
+        loaded.move_to_end(self)
+        while len(loaded) > AccountDb.MAX_LOADED_RECEIPTS:
+            account_db, _ = loaded.popitem(last=False)
+            account_db.receipts = None
+        return self.receipts
+
+    def read_receipts(self):
+        # the live journal only, older entries are in the archive
+        receipts = ReceiptIndex(
+            base_seq=AccountDb.STORE.get_receipt_base_seq(self.account_name))
+        for session_id, entry in AccountDb.STORE.iter_receipt_records(
+                self.account_name):
+            receipts.append(session_id, entry)
+        return receipts
+
+    def migrate_receipts(self, legacy_receipts):
+        logging.info("migrating %d receipt sessions of %s out of the "
+                     "account record" % (len(legacy_receipts),
+                                         self.account_name))
+        AccountDb.STORE.replace_receipt_records(
+            self.account_name, list(legacy_receipt_records(legacy_receipts)))
+        self.persist()
 
     ###########################################################################
 
+    def decoded_beacons(self):
+        if self.beacons is None:
+            self.beacons = [MoneysocketBeacon.from_bech32_str(b)[0] for b in
+                            self.db['beacons']]
+        return self.beacons
+
+    def update_all_shared_seeds(self):
+        # the shared seeds for both listening and outgoing
+        self.all_shared_seeds = (
+            self.shared_seeds + [b.get_shared_seed() for b in
+                                 self.decoded_beacons()])
+
+    def beacon_index(self, beacon):
+        for i, b in enumerate(self.decoded_beacons()):
+            if b is beacon:
+                return i
+        return self.db['beacons'].index(beacon.to_bech32_str())
+
     def add_beacon(self, beacon):
         beacon_str = beacon.to_bech32_str()
         self.db['beacons'].append(beacon_str)
+        self.decoded_beacons().append(beacon)
+        self.update_all_shared_seeds()
         self.persist()
 
     def remove_beacon(self, beacon):
-        beacon_str = beacon.to_bech32_str()
-        self.db['beacons'].remove(beacon_str)
+        i = self.beacon_index(beacon)
+        del self.db['beacons'][i]
+        del self.decoded_beacons()[i]
+        self.update_all_shared_seeds()
         self.persist()
 
     def add_shared_seed(self, shared_seed):
         shared_seed_str = str(shared_seed)
         self.db['shared_seeds'].append(shared_seed_str)
+        self.shared_seeds.append(shared_seed)
+        self.update_all_shared_seeds()
         self.persist()
 
     def remove_shared_seed(self, shared_seed):
-        shared_seed_str = str(shared_seed)
-        self.db['shared_seeds'].remove(shared_seed_str)
+        i = self.shared_seeds.index(shared_seed)
+        del self.db['shared_seeds'][i]
+        del self.shared_seeds[i]
+        self.update_all_shared_seeds()
         self.persist()
 
+    def set_pending_info(self, payment_hash, bolt11):
+        self.db['pending_expiry'][payment_hash] = (
+            BOLT11_CACHE.get_expiry(bolt11))
+        msats = BOLT11_CACHE.get_msats(bolt11)
+        self.db['pending_msats'][payment_hash] = msats if msats else 0
+
     def add_pending(self, payment_hash, bolt11):
+        if payment_hash in self.db['pending']:
+            self.remove_pending(payment_hash)
         self.db['pending'][payment_hash] = bolt11
+        self.set_pending_info(payment_hash, bolt11)
+        self.pending_msats += self.db['pending_msats'][payment_hash]
         self.persist()
 
     def remove_pending(self, payment_hash):
         _ = self.db['pending'].pop(payment_hash, None)
+        _ = self.db['pending_expiry'].pop(payment_hash, None)
+        self.pending_msats -= self.db['pending_msats'].pop(payment_hash, 0)
         self.persist()
 
     ###########################################################################
@@ -139,18 +302,37 @@ class AccountDb(object):
         return self.db['account_uuid']
 
     def iter_shared_seeds(self):
-        for ss in self.db['shared_seeds']:
-            yield SharedSeed.from_hex_string(ss)
+        for ss in self.shared_seeds:
+            yield ss
 
     def get_shared_seeds(self):
-        return list(self.iter_shared_seeds())
+        return list(self.shared_seeds)
+
+    def get_all_shared_seeds(self):
+        return list(self.all_shared_seeds)
+
+    def get_beacon_shared_seeds(self):
+        # the outgoing ones, without decoding the beacons
+        return self.all_shared_seeds[len(self.shared_seeds):]
 
     def iter_beacons(self):
-        for b in self.db['beacons']:
-            yield MoneysocketBeacon.from_bech32_str(b)[0]
+        for b in self.decoded_beacons():
+            yield b
 
     def get_beacons(self):
-        return list(self.iter_beacons())
+        return list(self.decoded_beacons())
+
+    def iter_beacon_strs(self):
+        # (bech32 string, decoded beacon) pairs
+        for beacon_str, beacon in zip(self.db['beacons'],
+                                      self.decoded_beacons()):
+            yield beacon_str, beacon
+
+    def get_beacon_str(self, beacon):
+        for beacon_str, b in self.iter_beacon_strs():
+            if b is beacon:
+                return beacon_str
+        return beacon.to_bech32_str()
 
     def iter_pending(self):
         for payment_hash, bolt11 in self.db['pending'].items():
@@ -159,6 +341,15 @@ class AccountDb(object):
     def get_pending(self):
         return list(self.iter_pending())
 
+    def has_pending(self, payment_hash):
+        return payment_hash in self.db['pending']
+
+    def get_pending_expiry(self, payment_hash):
+        return self.db['pending_expiry'][payment_hash]
+
+    def get_pending_msats(self):
+        return self.pending_msats
+
     ###########################################################################
 
     def set_wad(self, wad):
@@ -191,35 +382,64 @@ class AccountDb(object):
 
     ###########################################################################
 
-    def get_receipts(self):
-        return self.db['receipts']
+    def query_receipts(self, cursor=None, limit=100, since=None, until=None,
+                       entry_types=None):
+        receipts = self.get_receipts()
+        page, next_cursor = receipts.query(cursor=cursor, limit=limit,
+                                           since=since, until=until,
+                                           entry_types=entry_types)
+        if (next_cursor is not None or receipts.base_seq == 0 or
+                not AccountDb.ARCHIVE):
+            return page, next_cursor
+        # ran off the bottom of the live entries, carry on into the archive
+        below = (receipts.base_seq if cursor is None else
+                 min(cursor, receipts.base_seq))
+        return AccountDb.ARCHIVE.query(self.account_name, page, below, limit,
+                                       since=since, until=until,
+                                       entry_types=entry_types)
+
+    def archive_receipts(self, live_entries, max_age):
+        # moves the oldest entries beyond the newest live_entries, or older
+        # than max_age seconds, out to an archive segment. Segments go by
+        # seq, so a session still open just has its older entries archived.
+        # Entries not yet flushed stay put. 0 turns a limit off.
+        receipts = (self.receipts if self.receipts is not None else
+                    self.read_receipts())
+        flushed = len(receipts) - len(self.receipt_appends)
+        excess = len(receipts) - live_entries if live_entries > 0 else 0
+        cutoff = time.time() - max_age if max_age > 0 else None
+        n = 0
+        while n < flushed:
+            if n >= excess and (cutoff is None or
+                                receipts.times[n] >= cutoff):
+                break
+            n += 1
+        if n == 0:
+            return 0
+        first_seq = receipts.base_seq
+        AccountDb.ARCHIVE.add_segment(
+            self.account_name, first_seq,
+            list(receipts.iter_records(0, n)))
+        AccountDb.STORE.archive_receipt_records(self.account_name, n,
+                                                first_seq + n)
+        # read back from the store, with the new base, when next asked for
+        _ = AccountDb.LOADED_RECEIPTS.pop(self, None)
+        self.receipts = None
+        return n
 
     def new_receipt_session(self, shared_seed):
-        session = []
-        self.db['receipts'].insert(0, session)
-        self.session_index[shared_seed] = session
+        self.session_index[shared_seed] = str(uuid.uuid4())
 
     def add_receipt_entry(self, shared_seed, entry):
         if not shared_seed in self.session_index:
             logging.info("not keeping receipt: %s %s" % (shared_seed, entry))
             return
-        session = self.session_index[shared_seed]
-        session.insert(0, entry)
-        # TODO - this is gonna be slow for big receipt logs
-        # can fix by implementing append-to-end log
-        self.persist()
+        session_id = self.session_index[shared_seed]
+        if self.receipts is not None:
+            self.receipts.append(session_id, entry)
+        self.receipt_appends.append((session_id, entry))
+        self.queue_persist()
 
     def end_receipt_session(self, shared_seed):
         assert shared_seed in self.session_index, "unknown shared seed?"
         del self.session_index[shared_seed]
-
-    ###########################################################################
-
-    def prune_expired_pending(self):
-        for pending, bolt11 in list(self.iter_pending()):
-            info = Bolt11.to_dict(bolt11)
-            expire_timestamp = info['created_at'] + info['expiry']
-            #print("%s expire: %f" % (expire_timestamp,
-            #                          expire_timestamp - time.time()))
-            if time.time() > expire_timestamp:
-                del self.db['pending'][pending]
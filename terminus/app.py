@@ -2,6 +2,8 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
+import os
+import time
 import uuid
 import logging
 import argparse
@@ -10,7 +12,6 @@ from configparser import ConfigParser
 from txjsonrpc.web import jsonrpc
 from twisted.web import server
 from twisted.internet import reactor
-from twisted.internet.task import LoopingCall
 
 from moneysocket.utl.bolt11 import Bolt11
 
@@ -24,34 +25,137 @@ from terminus.rpc import TerminusRpc
 from terminus.account import Account
 from terminus.account_db import AccountDb
 from terminus.directory import TerminusDirectory
+from terminus.persist import PersistQueue
+from terminus.expiry import PendingExpiry
+from terminus.settlement import SettlementQueue
+from terminus.async_lightning import AsyncLightning
+from terminus.reconnect import ReconnectScheduler
+from terminus.json_store import JsonAccountStore
+from terminus.sqlite_store import SqliteAccountStore
+from terminus import metrics
+from terminus.metrics import Timer, MetricsResource, ReactorLagMonitor
+from terminus.profiler import TerminusProfiler
+from terminus.snapshot import DirectorySnapshot
+from terminus.archive import ReceiptArchive, ReceiptArchiver, DAY_SECONDS
+from terminus.bolt11_cache import BOLT11_CACHE, BOLT11_CACHE_SIZE
 
 
 MAX_BEACONS = 3
+MAX_INFLIGHT_PAYMENTS = 8
+MAX_INFLIGHT_INVOICES = 8
+MAX_CONNECTS_PER_SECOND = 20
+MAX_RECEIPTS_PAGE = 1000
+MAX_BULK_CREATE = 100000
+MAX_PROFILE_SECONDS = 600
+RECEIPT_CACHE_ACCOUNTS = 64
+SNAPSHOT_INTERVAL = 300
+RECEIPT_LIVE_ENTRIES = 10000
+RECEIPT_ARCHIVE_DAYS = 30
+RECEIPT_ARCHIVE_INTERVAL = 3600
+RECEIPT_RETENTION_DAYS = 0
 
 
 class TerminusApp(object):
     def __init__(self, config, lightning):
+        self.started_at = time.time()
         self.config = config
-        self.lightning = lightning
+        max_pays = int(self.config['App'].get('MaxInflightPayments',
+                                              MAX_INFLIGHT_PAYMENTS))
+        max_invoices = int(self.config['App'].get('MaxInflightInvoices',
+                                                  MAX_INFLIGHT_INVOICES))
+        self.lightning = AsyncLightning(lightning, max_pays, max_invoices)
         self.lightning.register_paid_recv_cb(self.node_received_payment_cb)
 
-        AccountDb.PERSIST_DIR = self.config['App']['AccountPersistDir']
+        AccountDb.STORE = self.setup_store()
+        persist_interval = float(self.config['App'].get('PersistInterval',
+                                                        0))
+        AccountDb.MAX_LOADED_RECEIPTS = int(self.config['App'].get(
+            'ReceiptCacheAccounts', RECEIPT_CACHE_ACCOUNTS))
+        BOLT11_CACHE.max_size = int(self.config['App'].get(
+            'Bolt11CacheSize', BOLT11_CACHE_SIZE))
+        AccountDb.PERSIST_QUEUE = PersistQueue(AccountDb.write_batch,
+                                               interval=persist_interval)
+        AccountDb.SNAPSHOT = self.setup_snapshot()
+        AccountDb.ARCHIVE, self.archiver = self.setup_archive()
 
         self.directory = TerminusDirectory()
         self.provider_stack = self.setup_provider_stack()
 
-        TerminusRpc.APP = self
+        compact = self.config['Rpc'].get('CompactResponses',
+                                         "False") == "True"
+        TerminusRpc.setup(self, compact=compact)
 
-        self.connect_loop = None
-        self.prune_loop = None
+        self.pending_expiry = PendingExpiry(self.pending_expired)
+        self.settlements = SettlementQueue(self.settle_payments)
+        connects_per_second = float(self.config['App'].get(
+            'MaxConnectsPerSecond', MAX_CONNECTS_PER_SECOND))
+        self.reconnect = ReconnectScheduler(self.reconnect_seed,
+                                            self.connection_state,
+                                            connects_per_second)
 
         self.local_seeds_connecting = set()
         self.local_seeds_connected = set()
         self.local_seeds_disconnected = set()
         self.local_seeds = set()
+        # seeds with an announced provider connection, for the metrics
+        self.announced_seeds = set()
+        self.setup_metrics()
+        self.profiler = TerminusProfiler(self.config['App']['LogDir'])
 
     ###########################################################################
 
+    def setup_store(self):
+        backend = self.config['App'].get('StorageBackend', "json")
+        assert backend in {"json", "sqlite"}, (
+            "unknown storage backend: %s" % backend)
+        if backend == "sqlite":
+            store = SqliteAccountStore(self.config['App']['SqlitePath'])
+        else:
+            store = JsonAccountStore(self.config['App']['AccountPersistDir'])
+        logging.info("using %s" % store)
+        return store
+
+    def setup_snapshot(self):
+        # json backend only, sqlite already reads its accounts in a few
+        # table scans
+        if not isinstance(AccountDb.STORE, JsonAccountStore):
+            return None
+        interval = float(self.config['App'].get('SnapshotInterval',
+                                                SNAPSHOT_INTERVAL))
+        snapshot = DirectorySnapshot(AccountDb.STORE, interval)
+        if interval <= 0:
+            # one left from before would be stale if turned back on later
+            snapshot.discard()
+            return None
+        return snapshot
+
+    def setup_archive(self):
+        # segments already archived stay readable with archiving turned off
+        persist_dir = self.config['App']['AccountPersistDir']
+        archive_dir = self.config['App'].get(
+            'ReceiptArchiveDir', os.path.join(persist_dir, "archive"))
+        retention_days = float(self.config['App'].get(
+            'ReceiptRetentionDays', RECEIPT_RETENTION_DAYS))
+        archive = ReceiptArchive(archive_dir, retention_days=retention_days)
+        self.receipt_live_entries = int(self.config['App'].get(
+            'ReceiptLiveEntries', RECEIPT_LIVE_ENTRIES))
+        self.receipt_archive_age = float(self.config['App'].get(
+            'ReceiptArchiveDays', RECEIPT_ARCHIVE_DAYS)) * DAY_SECONDS
+        if (self.receipt_live_entries <= 0 and
+                self.receipt_archive_age <= 0 and retention_days <= 0):
+            return archive, None
+        interval = float(self.config['App'].get('ReceiptArchiveInterval',
+                                                RECEIPT_ARCHIVE_INTERVAL))
+        return archive, ReceiptArchiver(self.archive_account, interval)
+
+    def setup_metrics(self):
+        metrics.ACCOUNTS.func = lambda: len(self.directory.accounts)
+        metrics.PENDING_INVOICES.func = lambda: sum(
+            len(payment_hashes) for payment_hashes in
+            self.directory.payment_hashes_by_account.values())
+        metrics.CONNECTED_SEEDS.func = lambda: len(self.announced_seeds)
+        self.lag_monitor = ReactorLagMonitor()
+
     def setup_provider_stack(self):
         s = BidirectionalProviderStack(self.config)
         s.onannounce = self.on_announce
@@ -69,6 +173,8 @@ class TerminusApp(object):
         ss = transact_nexus.get_shared_seed()
         if self.is_local_seed(ss):
             self.set_local_seed_connected(ss)
+        self.reconnect.connected(ss)
+        self.announced_seeds.add(ss)
 
         account = self.directory.lookup_by_seed(ss)
         assert account is not None, "shared seed not from known account?"
@@ -79,10 +185,15 @@ class TerminusApp(object):
         ss = transact_nexus.get_shared_seed()
         if self.is_local_seed(ss):
             self.set_local_seed_disconnected(ss)
+        self.announced_seeds.discard(ss)
 
         account = self.directory.lookup_by_seed(ss)
-        assert account is not None, "shared seed not from known account?"
+        if account is None:
+            # the connection went away because the account was cleared
+            logging.info("revoke of cleared shared seed: %s" % ss)
+            return
         account.end_session(ss)
+        self.reconnect.disconnected(ss)
 
     def on_stack_event(self, layer_name, nexus, status):
         #print("layer: %s   status: %s" % (layer_name, status))
@@ -129,44 +240,81 @@ class TerminusApp(object):
 
 
     def handle_pay_request(self, nexus, bolt11, request_uuid):
+        timer = Timer()
         shared_seed = nexus.get_shared_seed()
         account = self.directory.lookup_by_seed(shared_seed)
         assert account is not None, "shared seed not from known account?"
 
         shared_seeds = account.get_all_shared_seeds()
 
-        msats = Bolt11.get_msats(bolt11)
+        msats = BOLT11_CACHE.get_msats(bolt11)
         if (msats is None):
             err = "bolt11 does not specify amount",
             account.session_error_notified(shared_seed, err)
             self.provider_error(shared_seeds, err, request_uuid)
+            metrics.handled(timer, "pay_request", "no_amount")
             return
 
-        wad = account.get_wad()
-        if msats > wad['msats']:
+        if msats > account.get_available_msats():
             # TODO - estimate routing fees?
             err = "insufficent account balance"
             account.session_error_notified(shared_seed, err)
             self.provider_error(shared_seeds, err, request_uuid)
+            metrics.handled(timer, "pay_request", "insufficient_balance")
             return
 
         account.session_pay_requested(shared_seed, bolt11)
 
-        preimage, paid_msats, err = self.lightning.pay_invoice(bolt11,
-                                                               request_uuid)
+        # hold the amount against the balance until the node gets back to us
+        # so concurrent pays can't overdraw the account
+        reservation = account.reserve(msats)
+        d = self.lightning.pay_invoice(bolt11, request_uuid)
+        d.addCallbacks(self.pay_finished, self.pay_failed,
+                       callbackArgs=(account, shared_seed, reservation,
+                                     request_uuid),
+                       errbackArgs=(account, shared_seed, reservation,
+                                    request_uuid))
+        metrics.handled(timer, "pay_request", "dispatched")
+
+    def pay_finished(self, result, account, shared_seed, reservation,
+                     request_uuid):
+        timer = Timer()
+        account.release(reservation)
+        preimage, paid_msats, err = result
+        shared_seeds = account.get_all_shared_seeds()
         if err:
             account.session_error_notified(shared_seed, err)
             self.provider_error(shared_seeds, err, request_uuid)
+            metrics.handled(timer, "pay_finished", "error")
             return
 
         paid_wad = Wad.bitcoin(paid_msats)
 
+        wad = account.get_wad()
         if (paid_msats > wad['msats']):
             # routing fees could have exceeded balance... need to figure
             # out the best way to deal with this
             paid_msats = wad['msats']
         account.subtract_wad(paid_wad)
 
+        # the balance change must be on disk before the preimage goes out
+        d = AccountDb.barrier()
+        d.addCallback(self.notify_paid, account, shared_seeds, preimage,
+                      paid_msats, request_uuid)
+        metrics.handled(timer, "pay_finished", "paid")
+
+    def pay_failed(self, failure, account, shared_seed, reservation,
+                   request_uuid):
+        metrics.HANDLER_REQUESTS.inc("pay_finished", "exception")
+        account.release(reservation)
+        logging.error("pay failed: %s" % failure.getTraceback())
+        err = "payment failed: %s" % failure.getErrorMessage()
+        shared_seeds = account.get_all_shared_seeds()
+        account.session_error_notified(shared_seed, err)
+        self.provider_error(shared_seeds, err, request_uuid)
+
+    def notify_paid(self, _, account, shared_seeds, preimage, paid_msats,
+                    request_uuid):
         # TODO new pay preimage message to propagate fees
         self.provider_stack.notify_preimage(shared_seeds, preimage,
                                             request_uuid)
@@ -175,6 +323,7 @@ class TerminusApp(object):
                                               paid_msats)
 
     def handle_invoice_request(self, nexus, msats, request_uuid):
+        timer = Timer()
         shared_seed = nexus.get_shared_seed()
         account = self.directory.lookup_by_seed(shared_seed)
         assert account is not None, "shared seed not from known account?"
@@ -184,24 +333,60 @@ class TerminusApp(object):
 
         wad = account.get_wad()
         cap = account.get_cap()
-        if cap['msats'] != 0 and (msats + wad['msats'] > cap['msats']):
-            # TODO 0 track pending incoming?
+        incoming_msats = account.get_incoming_msats()
+        if cap['msats'] != 0 and (msats + wad['msats'] + incoming_msats >
+                                  cap['msats']):
             err = "account cap exceeded"
             account.session_error_notified(shared_seed, err)
             self.provider_error(shared_seeds, err, request_uuid)
+            metrics.handled(timer, "invoice_request", "cap_exceeded")
             return
 
-        bolt11, err = self.lightning.get_invoice(msats)
+        # count the amount against the cap while the node works on it
+        reservation = account.reserve_incoming(msats)
+        d = self.lightning.get_invoice(msats)
+        d.addCallbacks(self.invoice_finished, self.invoice_failed,
+                       callbackArgs=(account, shared_seed, reservation,
+                                     request_uuid),
+                       errbackArgs=(account, shared_seed, reservation,
+                                    request_uuid))
+        metrics.handled(timer, "invoice_request", "dispatched")
+
+    def invoice_finished(self, result, account, shared_seed, reservation,
+                         request_uuid):
+        timer = Timer()
+        account.release_incoming(reservation)
+        bolt11, err = result
+        shared_seeds = account.get_all_shared_seeds()
         if err:
             account.session_error_notified(shared_seed, err)
             self.provider_error(shared_seeds, err, request_uuid)
+            metrics.handled(timer, "invoice_finished", "error")
             return
 
-        payment_hash = Bolt11.get_payment_hash(bolt11)
+        payment_hash = BOLT11_CACHE.get_payment_hash(bolt11)
         account.add_pending(payment_hash, bolt11)
+        self.schedule_expiry(account, payment_hash)
+        self.directory.add_pending(account, payment_hash)
+        # the pending invoice must be on disk before anybody can pay it
+        d = AccountDb.barrier()
+        d.addCallback(self.notify_invoice, account, shared_seeds, bolt11,
+                      request_uuid)
+        metrics.handled(timer, "invoice_finished", "invoiced")
+
+    def invoice_failed(self, failure, account, shared_seed, reservation,
+                       request_uuid):
+        metrics.HANDLER_REQUESTS.inc("invoice_finished", "exception")
+        account.release_incoming(reservation)
+        logging.error("invoice failed: %s" % failure.getTraceback())
+        err = "invoice failed: %s" % failure.getErrorMessage()
+        shared_seeds = account.get_all_shared_seeds()
+        account.session_error_notified(shared_seed, err)
+        self.provider_error(shared_seeds, err, request_uuid)
+
+    def notify_invoice(self, _, account, shared_seeds, bolt11, request_uuid):
         for ss in shared_seeds:
-            account.session_invoice_notified(shared_seed, bolt11)
-        self.directory.reindex_account(account)
+            account.session_invoice_notified(ss, bolt11)
         self.provider_stack.notify_invoice(shared_seeds, bolt11, request_uuid)
 
 
@@ -210,32 +395,79 @@ class TerminusApp(object):
     def node_received_payment_cb(self, preimage, msats):
         received_wad = Wad.bitcoin(msats)
         logging.info("node received payment: %s %s" % (preimage, received_wad))
-
-        payment_hash = Bolt11.preimage_to_payment_hash(preimage)
-        # find accounts with this payment_hash
-        accounts = self.directory.lookup_by_payment_hash(payment_hash)
-
-        if len(accounts) > 1:
-            logging.error("can't deal with more than one account with "
-                          "a preimage collision yet")
-            # TODO deal with this somehow - feed preimage back into lightning
-            # node to claim any pending htlcs?
+        self.settlements.add(preimage, msats)
+
+    def settle_payments(self, payments):
+        # everything the node reported in one reactor turn: pending
+        # invoices come off as each payment is matched, each account's
+        # balance goes up once by its total, and the notifications go out in
+        # arrival order once all of it is on disk
+        timer = Timer()
+        credits = {}
+        credited = []
+        for preimage, msats in payments:
+            payment_hash = Bolt11.preimage_to_payment_hash(preimage)
+            # find accounts with this payment_hash
+            accounts = self.directory.lookup_by_payment_hash(payment_hash)
+
+            if len(accounts) > 1:
+                logging.error("can't deal with more than one account with "
+                              "a preimage collision yet")
+                # TODO deal with this somehow - feed preimage back into
+                # lightning node to claim any pending htlcs?
+                metrics.HANDLER_REQUESTS.inc("received_payment", "collision")
+                continue
+
+            if len(accounts) == 0:
+                logging.error("incoming payment not known")
+                metrics.HANDLER_REQUESTS.inc("received_payment", "unknown")
+                continue
+
+            account = list(accounts)[0]
+            shared_seeds = account.get_all_shared_seeds()
+            account.remove_pending(payment_hash)
+            self.directory.remove_pending(account, payment_hash)
+            credits[account] = credits.get(account, 0) + msats
+            credited.append((account, shared_seeds, preimage, msats))
+            metrics.HANDLER_REQUESTS.inc("received_payment", "credited")
+        for account, msats in credits.items():
+            account.add_wad(Wad.bitcoin(msats))
+        timer.observe(metrics.HANDLER_SECONDS, "received_payment")
+        metrics.SETTLEMENT_BATCH.observe(len(payments))
+        if len(credited) == 0:
             return
+        d = AccountDb.barrier()
+        d.addCallback(self.notify_settled, credited)
 
-        if len(accounts) == 0:
-            logging.error("incoming payment not known")
-            return
+    def notify_settled(self, _, credited):
+        for account, shared_seeds, preimage, msats in credited:
+            self.notify_received(None, account, shared_seeds, preimage,
+                                 msats)
 
-        account = list(accounts)[0]
-        shared_seeds = account.get_all_shared_seeds()
-        account.remove_pending(payment_hash)
-        account.add_wad(received_wad)
+    def notify_received(self, _, account, shared_seeds, preimage, msats):
         self.provider_stack.notify_preimage(shared_seeds, preimage, None)
         for ss in shared_seeds:
             account.session_preimage_notified(ss, preimage, True, msats)
 
     ##########################################################################
 
+    def schedule_expiry(self, account, payment_hash):
+        self.pending_expiry.add(account.get_pending_expiry(payment_hash),
+                                account.get_name(), payment_hash)
+
+    def pending_expired(self, account_name, payment_hash):
+        account = self.directory.lookup_by_name(account_name)
+        if not account or not account.has_pending(payment_hash):
+            # paid or removed since it was scheduled
+            return
+        logging.info("pending invoice expired: %s %s" % (account_name,
+                                                         payment_hash))
+        account.remove_pending(payment_hash)
+        self.directory.remove_pending(account, payment_hash)
+        metrics.HANDLER_REQUESTS.inc("pending_expired", "expired")
+
+    ##########################################################################
+
     def _getinfo_dict(self):
         locations = self.provider_stack.get_listen_locations()
         accounts = self.directory.get_account_list()
@@ -251,8 +483,12 @@ class TerminusApp(object):
         account_set = set(args.accounts)
         if len(account_set) == 0:
             return {'success': True, 'accounts': []}
-        all_accounts = self._getinfo_dict()['accounts']
-        accounts = [a for a in all_accounts if a['name'] in account_set]
+        locations = self.provider_stack.get_listen_locations()
+        accounts = []
+        for name in sorted(account_set):
+            account = self.directory.lookup_by_name(name)
+            if account:
+                accounts.append(account.get_attributes(locations))
         return {'success': True, 'accounts': accounts}
 
     ##########################################################################
@@ -262,40 +498,69 @@ class TerminusApp(object):
         account = self.directory.lookup_by_name(name)
         if not account:
             return {'success': False, 'error': "*** unknown account: %s" % name}
-        receipts = account.get_receipts()
-        return {'success':  True,
-                'name':     name,
-                'receipts': receipts}
+        cursor = None
+        if args.cursor is not None:
+            try:
+                cursor = int(args.cursor)
+            except ValueError:
+                return {'success': False,
+                        'error': "*** bad cursor: %s" % args.cursor}
+        if args.limit < 1 or args.limit > MAX_RECEIPTS_PAGE:
+            return {'success': False,
+                    'error': "*** limit must be 1 to %d" % MAX_RECEIPTS_PAGE}
+        page, next_cursor = account.query_receipts(
+            cursor=cursor, limit=args.limit, since=args.since,
+            until=args.until, entry_types=args.type)
+        receipts = []
+        for seq, session_id, entry in page:
+            receipt = {'seq': seq, 'session': session_id}
+            receipt.update(entry)
+            receipts.append(receipt)
+        return {'success':     True,
+                'name':        name,
+                'receipts':    receipts,
+                'next_cursor': (str(next_cursor) if next_cursor is not None
+                                else None)}
 
     ##########################################################################
 
     def gen_account_name(self, name):
-        i = 0
-        def account_name(n):
-            return "%s-%d" % (name, n)
-        while self.directory.lookup_by_name(account_name(i)) is not None:
-            i += 1
-        return account_name(i)
+        return self.directory.allocate_account_name(name)
 
+    def parse_wad_and_cap(self, msatoshis, cap_msatoshis):
+        wad, err = Wad.bitcoin_from_msat_string(msatoshis)
+        if err:
+            return None, None, err
+        if cap_msatoshis == "none":
+            return wad, Wad.bitcoin(0), None
+        cap, err = Wad.bitcoin_from_msat_string(cap_msatoshis)
+        if err:
+            return None, None, err
+        return wad, cap, None
 
     def create(self, args):
-        wad, err = Wad.bitcoin_from_msat_string(args.msatoshis)
+        wad, cap, err = self.parse_wad_and_cap(args.msatoshis, args.cap)
         if err:
             return {'success': False, "error": "*** " + err}
-
-        if args.cap == "none":
-            cap = Wad.bitcoin(0)
-        else:
-            cap, err = Wad.bitcoin_from_msat_string(args.cap)
-            if err:
-                return {'success': False, "error": "*** " + err}
         name = self.gen_account_name(args.account_name)
-        account = Account(name)
-        account.set_wad(wad)
-        account.set_cap(cap)
-        self.directory.add_account(account)
+        account_db = AccountDb.create_batch([name], wad, cap)[0]
+        self.directory.add_account(Account(name, db=account_db))
         return {'success': True, 'name': name, "wad": wad, 'cap': cap}
 
+    def bulkcreate(self, args):
+        if args.count < 1 or args.count > MAX_BULK_CREATE:
+            return {'success': False,
+                    'error': "*** count must be 1 to %d" % MAX_BULK_CREATE}
+        wad, cap, err = self.parse_wad_and_cap(args.msatoshis, args.cap)
+        if err:
+            return {'success': False, "error": "*** " + err}
+        names = [self.gen_account_name(args.account_name) for _ in
+                 range(args.count)]
+        for account_db in AccountDb.create_batch(names, wad, cap):
+            self.directory.add_account(Account(account_db.get_name(),
+                                               db=account_db))
+        return {'success': True, 'names': names, "wad": wad, 'cap': cap}
+
     ##########################################################################
 
     def rm(self, args):
@@ -309,6 +574,10 @@ class TerminusApp(object):
             return {'success': False,
                     'error': "*** still has connections: %s" % name}
 
+        if account.has_reservations():
+            return {'success': False,
+                    'error': "*** still has payments in flight: %s" % name}
+
         self.directory.remove_account(account)
         account.depersist()
         return {'success': True, "name": name}
@@ -336,10 +605,9 @@ class TerminusApp(object):
                     'error': "*** max %s beacons per account" % MAX_BEACONS}
 
         shared_seed = beacon.shared_seed
-        connection_attempt = self.provider_stack.connect(location, shared_seed)
-        account.add_connection_attempt(beacon, connection_attempt)
         account.add_beacon(beacon)
-        self.directory.reindex_account(account)
+        self.directory.add_shared_seed(account, shared_seed)
+        self.connect_beacon(account, beacon)
         return {'success': True, "name": name, "location": str(location)}
 
 
@@ -372,7 +640,7 @@ class TerminusApp(object):
         # register shared seed with local listener
         self.provider_stack.local_connect(shared_seed)
         self.set_local_seed_connecting(shared_seed)
-        self.directory.reindex_account(account)
+        self.directory.add_shared_seed(account, shared_seed)
         return {'success': True, "name": name,
                 "beacon": beacon.to_bech32_str()}
 
@@ -392,69 +660,169 @@ class TerminusApp(object):
         for beacon in account.get_beacons():
             shared_seed = beacon.get_shared_seed()
             self.provider_stack.disconnect(shared_seed)
+            self.reconnect.forget(shared_seed)
             account.remove_beacon(beacon)
+            self.directory.remove_shared_seed(account, shared_seed)
 
         # deregister from local layer
         for shared_seed in account.get_shared_seeds():
             self.provider_stack.local_disconnect(shared_seed)
+            self.reconnect.forget(shared_seed)
             self.clear_local_seed(shared_seed)
             account.remove_shared_seed(shared_seed)
-        self.directory.reindex_account(account)
+            self.directory.remove_shared_seed(account, shared_seed)
         return {'success': True, "name": name}
 
     ##########################################################################
 
+    def profile(self, args):
+        if args.action == "status":
+            info = self.profiler.status()
+            info['success'] = True
+            return info
+        if args.action == "start":
+            if self.profiler.is_running():
+                return {'success': False,
+                        'error': "*** profiler already running"}
+            if args.seconds <= 0 or args.seconds > MAX_PROFILE_SECONDS:
+                return {'success': False,
+                        'error': "*** seconds must be above 0 and at most "
+                                 "%d" % MAX_PROFILE_SECONDS}
+            if args.interval <= 0:
+                return {'success': False,
+                        'error': "*** interval must be above 0"}
+            self.profiler.start(args.mode, args.seconds,
+                                args.interval / 1000.0)
+            return {'success': True, 'mode': args.mode,
+                    'seconds': args.seconds}
+        if not self.profiler.is_running():
+            return {'success': False, 'error': "*** profiler not running"}
+        if args.action == "dump":
+            return {'success': True, 'file': self.profiler.dump()}
+        path, seconds = self.profiler.stop()
+        return {'success': True, 'file': path, 'seconds': seconds}
+
+    ##########################################################################
+
     def load_persisted(self):
-        for account in Account.iter_persisted_accounts():
-            self.directory.add_account(account)
-            for beacon in account.get_beacons():
-                location = beacon.locations[0]
-                assert location.to_dict()['type'] == "WebSocket"
-                shared_seed = beacon.shared_seed
-                connection_attempt = self.provider_stack.connect(location,
-                                                                 shared_seed)
-                account.add_connection_attempt(beacon, connection_attempt)
+        # account headers only, receipts are read when first asked for
+        start = time.time()
+        loaded = self.read_snapshot()
+        accounts = list(Account.iter_persisted_accounts(loaded=loaded))
+        self.directory.add_accounts(accounts)
+        if AccountDb.SNAPSHOT:
+            if loaded is None:
+                AccountDb.SNAPSHOT.reset([account.db for account in
+                                          accounts])
+                AccountDb.SNAPSHOT.checkpoint()
+            else:
+                AccountDb.SNAPSHOT.schedule(AccountDb.SNAPSHOT.interval)
+        n_beacons = 0
+        for account in accounts:
+            # outgoing connections go out under the reconnect rate limit
+            # instead of all at once
+            for shared_seed in account.get_beacon_shared_seeds():
+                n_beacons += 1
+                self.reconnect.enqueue(shared_seed)
             for shared_seed in account.get_shared_seeds():
                 self.provider_stack.local_connect(shared_seed)
                 self.set_local_seed_connecting(shared_seed)
+            for payment_hash, _ in account.get_pending():
+                self.schedule_expiry(account, payment_hash)
+        logging.info("loaded %d accounts in %.2fs, %d outgoing connections "
+                     "queued" % (len(accounts), time.time() - start,
+                                 n_beacons))
+
+    def archive_account(self, account):
+        if self.directory.lookup_by_name(account.get_name()) is not account:
+            # removed since the sweep started
+            return 0
+        n = account.archive_receipts(self.receipt_live_entries,
+                                     self.receipt_archive_age)
+        AccountDb.ARCHIVE.apply_retention(account.get_name(), time.time())
+        return n
+
+    def read_snapshot(self):
+        # (record, shared seed hex strings) pairs from the snapshot if there
+        # is one that can be trusted, otherwise None to read them all from
+        # the store
+        if not AccountDb.SNAPSHOT:
+            return None
+        accounts = AccountDb.SNAPSHOT.load()
+        if accounts is None:
+            return None
+        if not AccountDb.SNAPSHOT.is_current(accounts):
+            logging.error("snapshot out of step with %s, reading every "
+                          "account" % AccountDb.STORE)
+            return None
+        return list(accounts.values())
 
     ##########################################################################
 
-    def retry_connections(self):
-        for account in self.directory.iter_accounts():
-            disconnected_beacons = account.get_disconnected_beacons()
-            for beacon in disconnected_beacons:
-                #logging.error("disconnected: %s" % beacon.to_bech32_str())
-                location = beacon.locations[0]
-                assert location.to_dict()['type'] == "WebSocket"
-                shared_seed = beacon.shared_seed
-                connection_attempt = self.provider_stack.connect(location,
-                                                                 shared_seed)
-                account.add_connection_attempt(beacon, connection_attempt)
-        for shared_seed in self.local_seeds:
+    def connect_beacon(self, account, beacon):
+        location = beacon.locations[0]
+        assert location.to_dict()['type'] == "WebSocket"
+        shared_seed = beacon.shared_seed
+        connection_attempt = self.provider_stack.connect(location,
+                                                         shared_seed)
+        account.add_connection_attempt(beacon, connection_attempt)
+        self.reconnect.watch(shared_seed)
+
+    def reconnect_seed(self, shared_seed):
+        if self.is_local_seed(shared_seed):
             if self.is_local_seed_disconnected(shared_seed):
                 self.provider_stack.local_connect(shared_seed)
                 self.set_local_seed_connecting(shared_seed)
+            return
+        account = self.directory.lookup_by_seed(shared_seed)
+        beacon = account.get_beacon_by_seed(shared_seed) if account else None
+        if not beacon:
+            self.reconnect.forget(shared_seed)
+            return
+        self.connect_beacon(account, beacon)
 
-    def prune_expired_pending(self):
-        for account in self.directory.iter_accounts():
-            account.prune_expired_pending()
+    def connection_state(self, shared_seed):
+        account = self.directory.lookup_by_seed(shared_seed)
+        if not account:
+            return None
+        beacon = account.get_beacon_by_seed(shared_seed)
+        if not beacon:
+            return None
+        return account.get_connection_state(beacon)
 
     ##########################################################################
 
+    def listen_metrics(self):
+        if not self.config.has_section('Metrics'):
+            return
+        if self.config['Metrics'].get('Enabled', "False") != "True":
+            return
+        metrics_interface = self.config['Metrics'].get('BindHost',
+                                                       "127.0.0.1")
+        metrics_port = int(self.config['Metrics'].get('BindPort', 11055))
+        logging.info("metrics on %s:%d" % (metrics_interface, metrics_port))
+        reactor.listenTCP(metrics_port, server.Site(MetricsResource()),
+                          interface=metrics_interface)
+        self.lag_monitor.start()
+
     def run_app(self):
         rpc_interface = self.config['Rpc']['BindHost']
         rpc_port = int(self.config['Rpc']['BindPort'])
         logging.info("listening on %s:%d" % (rpc_interface, rpc_port))
         reactor.listenTCP(rpc_port, server.Site(TerminusRpc()),
                           interface=rpc_interface)
+        self.listen_metrics()
 
         self.load_persisted()
+        if self.archiver:
+            self.archiver.start(self.directory.get_account_list)
 
         self.provider_stack.listen()
-
-        self.connect_loop = LoopingCall(self.retry_connections)
-        self.connect_loop.start(5, now=False)
-
-        self.prune_loop = LoopingCall(self.prune_expired_pending)
-        self.prune_loop.start(3, now=False)
+        logging.info("ready in %.2fs" % (time.time() - self.started_at))
+
+        reactor.addSystemEventTrigger('before', 'shutdown',
+                                      AccountDb.PERSIST_QUEUE.flush)
+        if AccountDb.SNAPSHOT:
+            # so the next start has no tail to replay
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                                          AccountDb.SNAPSHOT.checkpoint)
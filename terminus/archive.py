@@ -0,0 +1,240 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import gzip
+import json
+import time
+import shutil
+import logging
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+from terminus.receipts import ReceiptIndex
+
+
+# decoded segments kept in memory for paging through them
+MAX_LOADED_SEGMENTS = 8
+# accounts looked at per reactor turn during a sweep
+ACCOUNTS_PER_TURN = 50
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+class ReceiptArchive(object):
+    """ Receipt entries moved out of the live journals, in immutable gzipped
+    segments of journal lines under <archive_dir>/<account>/, one per
+    archiving run, named by the seq of their first entry. A manifest per
+    account lists them with their seq and time range and the entry types
+    they hold so queries only open the ones they need. """
+    def __init__(self, archive_dir, retention_days=0):
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        if not os.path.exists(self.archive_dir):
+            os.makedirs(self.archive_dir)
+        self.manifests = {}
+        self.loaded_segments = OrderedDict()
+
+    def __str__(self):
+        return "receipt archive: %s" % self.archive_dir
+
+    ###########################################################################
+
+    def account_dir(self, account_name):
+        return os.path.join(self.archive_dir, account_name)
+
+    def manifest_filename(self, account_name):
+        return os.path.join(self.account_dir(account_name), "manifest.json")
+
+    def segment_filename(self, account_name, first_seq):
+        return os.path.join(self.account_dir(account_name),
+                            "%d.jsonl.gz" % first_seq)
+
+    def sync_dir(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    ###########################################################################
+
+    def get_manifest(self, account_name):
+        if account_name in self.manifests:
+            return self.manifests[account_name]
+        path = self.manifest_filename(account_name)
+        manifest = {'segments': []}
+        if os.path.exists(path):
+            f = open(path, 'r')
+            manifest = json.loads(f.read())
+            f.close()
+        self.manifests[account_name] = manifest
+        return manifest
+
+    def write_manifest(self, account_name, manifest):
+        path = self.manifest_filename(account_name)
+        f = open(path + ".tmp", 'w')
+        f.write(json.dumps(manifest))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(path + ".tmp", path)
+        self.sync_dir(self.account_dir(account_name))
+        self.manifests[account_name] = manifest
+
+    def has_segments(self, account_name):
+        return len(self.get_manifest(account_name)['segments']) > 0
+
+    ###########################################################################
+
+    def add_segment(self, account_name, first_seq, receipt_records):
+        # written and synced before it goes in the manifest. A segment left
+        # in the manifest by a run that died before the live journal was
+        # cut back is rewritten by the next run over the same entries.
+        d = self.account_dir(account_name)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        path = self.segment_filename(account_name, first_seq)
+        f = gzip.open(path + ".tmp", 'wt')
+        for session_id, entry in receipt_records:
+            f.write(json.dumps({'session': session_id, 'entry': entry}) +
+                    "\n")
+        f.close()
+        f = open(path + ".tmp", 'rb')
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(path + ".tmp", path)
+        _ = self.loaded_segments.pop(path, None)
+        times = [entry['time'] for _, entry in receipt_records]
+        segment = {'first_seq': first_seq,
+                   'end_seq':   first_seq + len(receipt_records),
+                   'since':     min(times),
+                   'until':     max(times),
+                   'types':     sorted({entry['type'] for _, entry in
+                                        receipt_records})}
+        manifest = self.get_manifest(account_name)
+        segments = [s for s in manifest['segments'] if
+                    s['first_seq'] < first_seq] + [segment]
+        self.write_manifest(account_name, {'segments': segments})
+        return os.path.getsize(path)
+
+    def apply_retention(self, account_name, now):
+        if self.retention_days <= 0 or not self.has_segments(account_name):
+            return 0
+        cutoff = now - self.retention_days * DAY_SECONDS
+        manifest = self.get_manifest(account_name)
+        expired = [s for s in manifest['segments'] if s['until'] < cutoff]
+        if len(expired) == 0:
+            return 0
+        # out of the manifest first, an unlisted segment is never read
+        self.write_manifest(account_name, {'segments': [
+            s for s in manifest['segments'] if s['until'] >= cutoff]})
+        for segment in expired:
+            path = self.segment_filename(account_name, segment['first_seq'])
+            _ = self.loaded_segments.pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info("dropped %d expired receipt segments of %s" % (
+            len(expired), account_name))
+        return len(expired)
+
+    def remove_account(self, account_name):
+        _ = self.manifests.pop(account_name, None)
+        d = self.account_dir(account_name)
+        for path in list(self.loaded_segments.keys()):
+            if os.path.dirname(path) == d:
+                del self.loaded_segments[path]
+        if os.path.exists(d):
+            shutil.rmtree(d)
+
+    ###########################################################################
+
+    def read_segment(self, account_name, segment):
+        path = self.segment_filename(account_name, segment['first_seq'])
+        if path in self.loaded_segments:
+            self.loaded_segments.move_to_end(path)
+            return self.loaded_segments[path]
+        receipts = ReceiptIndex(base_seq=segment['first_seq'])
+        f = gzip.open(path, 'rt')
+        for line in f:
+            record = json.loads(line)
+            receipts.append(record['session'], record['entry'])
+        f.close()
+        self.loaded_segments[path] = receipts
+        while len(self.loaded_segments) > MAX_LOADED_SEGMENTS:
+            _ = self.loaded_segments.popitem(last=False)
+        return receipts
+
+    def query(self, account_name, page, below, limit, since=None,
+              until=None, entry_types=None):
+        # carries on a page from the live entries with the segments holding
+        # entries below the seq given, newest first. Returns the page and
+        # cursor the way ReceiptIndex.query() does.
+        page = list(page)
+        segments = sorted(self.get_manifest(account_name)['segments'],
+                          key=lambda s: s['first_seq'], reverse=True)
+        for segment in segments:
+            if segment['first_seq'] >= below:
+                continue
+            if since is not None and segment['until'] < since:
+                break
+            if until is not None and segment['since'] > until:
+                continue
+            if entry_types is not None and not (set(entry_types) &
+                                                set(segment['types'])):
+                continue
+            remaining = limit - len(page)
+            more, cursor = self.read_segment(account_name, segment).query(
+                cursor=below, limit=max(remaining, 1), since=since,
+                until=until, entry_types=entry_types)
+            if remaining == 0:
+                if len(more) > 0:
+                    return page, page[-1][0]
+                continue
+            page += more
+            if cursor is not None:
+                return page, cursor
+        return page, None
+
+
+###############################################################################
+
+class ReceiptArchiver(object):
+    """ Sweeps every account every interval, a few per reactor turn, handing
+    each to the archive callback. """
+    def __init__(self, archive_cb, interval):
+        self.archive_cb = archive_cb
+        self.interval = interval
+        self.get_accounts = None
+        self.queue = []
+        self.sweep_call = None
+        self.started_at = None
+        self.archived = 0
+
+    def start(self, get_accounts):
+        self.get_accounts = get_accounts
+        self.sweep_call = reactor.callLater(self.interval, self.sweep)
+
+    def stop(self):
+        if self.sweep_call and self.sweep_call.active():
+            self.sweep_call.cancel()
+        self.sweep_call = None
+
+    def sweep(self):
+        self.queue = self.get_accounts()
+        self.queue.reverse()
+        self.started_at = time.time()
+        self.archived = 0
+        self.turn()
+
+    def turn(self):
+        for _ in range(min(ACCOUNTS_PER_TURN, len(self.queue))):
+            self.archived += self.archive_cb(self.queue.pop())
+        if len(self.queue) > 0:
+            self.sweep_call = reactor.callLater(0, self.turn)
+            return
+        logging.info("receipt archive sweep: %d entries archived in %.2fs" %
+                     (self.archived, time.time() - self.started_at))
+        self.sweep_call = reactor.callLater(self.interval, self.sweep)
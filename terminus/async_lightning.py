@@ -0,0 +1,55 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from terminus.metrics import Timer, LIGHTNING_SECONDS
+
+
+class AsyncLightning(object):
+    """ Wraps a blocking lightning backend (CLightning, Lnd) so that payments
+    and invoice creation run on bounded thread pools and hand back a
+    Deferred instead of holding up the reactor. Calls beyond the pool size
+    queue up for a free thread. """
+    def __init__(self, lightning, max_pays, max_invoices):
+        self.lightning = lightning
+        self.pay_pool = self.start_pool(max_pays, "terminus-pay")
+        self.invoice_pool = self.start_pool(max_invoices, "terminus-invoice")
+
+    def start_pool(self, size, name):
+        pool = ThreadPool(minthreads=0, maxthreads=size, name=name)
+        pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', pool.stop)
+        return pool
+
+    ###########################################################################
+
+    def register_paid_recv_cb(self, cb):
+        self.lightning.register_paid_recv_cb(cb)
+
+    def timed(self, d, call):
+        timer = Timer()
+        def finished(result):
+            # the backend reports its own errors as the last tuple member
+            outcome = "error" if result[-1] else "ok"
+            timer.observe(LIGHTNING_SECONDS, call, outcome)
+            return result
+        def failed(failure):
+            timer.observe(LIGHTNING_SECONDS, call, "exception")
+            return failure
+        d.addCallbacks(finished, failed)
+        return d
+
+    def get_invoice(self, msats):
+        # fires with the (bolt11, err) tuple of the backend
+        return self.timed(threads.deferToThreadPool(
+            reactor, self.invoice_pool, self.lightning.get_invoice, msats),
+            "get_invoice")
+
+    def pay_invoice(self, bolt11, request_uuid):
+        # fires with the (preimage, paid_msats, err) tuple of the backend
+        return self.timed(threads.deferToThreadPool(
+            reactor, self.pay_pool, self.lightning.pay_invoice, bolt11,
+            request_uuid), "pay_invoice")
@@ -0,0 +1,68 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+from collections import OrderedDict
+
+from moneysocket.utl.bolt11 import Bolt11
+
+from terminus.metrics import BOLT11_LOOKUPS
+
+
+BOLT11_CACHE_SIZE = 10000
+
+
+class DecodedBolt11(object):
+    """ The fields of an invoice the terminus uses. """
+    __slots__ = ['msats', 'payment_hash', 'created_at', 'expiry', 'payee']
+
+    def __init__(self, info):
+        self.msats = info.get('msatoshi')
+        self.payment_hash = info['payment_hash']
+        self.created_at = info['created_at']
+        self.expiry = info['expiry']
+        self.payee = info.get('payee')
+
+
+class Bolt11Cache(object):
+    """ Decoded invoices by bolt11 string, least recently used dropped
+    first. An invoice is decoded once however many handlers look at it,
+    the bech32 decode and signature recovery being most of the cost.
+    Invoices that fail to decode aren't kept. """
+    def __init__(self, max_size=BOLT11_CACHE_SIZE):
+        self.max_size = max_size
+        self.decoded = OrderedDict()
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def decode(self, bolt11):
+        decoded = self.decoded.get(bolt11)
+        if decoded is not None:
+            BOLT11_LOOKUPS.inc("hit")
+            self.decoded.move_to_end(bolt11)
+            return decoded
+        BOLT11_LOOKUPS.inc("miss")
+        decoded = DecodedBolt11(Bolt11.to_dict(bolt11))
+        self.decoded[bolt11] = decoded
+        while len(self.decoded) > self.max_size:
+            _ = self.decoded.popitem(last=False)
+        return decoded
+
+    def clear(self):
+        self.decoded.clear()
+
+    ###########################################################################
+
+    def get_msats(self, bolt11):
+        return self.decode(bolt11).msats
+
+    def get_payment_hash(self, bolt11):
+        return self.decode(bolt11).payment_hash
+
+    def get_expiry(self, bolt11):
+        decoded = self.decode(bolt11)
+        return decoded.created_at + decoded.expiry
+
+
+BOLT11_CACHE = Bolt11Cache()
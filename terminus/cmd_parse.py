@@ -4,77 +4,99 @@
 
 import argparse
 
+from terminus.receipts import ENTRY_TYPES
+from terminus.profiler import MODES as PROFILE_MODES
+
+
+# The app commands as (name, subparser kwargs, [(flags, argument kwargs)]).
+# The CLI builds its argparse tree from this and the RPC server validates
+# named JSON-RPC params against the same arguments.
+COMMANDS = [
+    ('getinfo', {'help': 'display summary'}, []),
+    ('getaccountinfo',
+     {'help': 'get info about a specific set of accounts'},
+     [(("accounts",), {'type': str, 'nargs': '*',
+                       'help': "account names to filter results"})]),
+    ('getaccountreceipts',
+     {'help': 'get the transaction receipts of a specific account'},
+     [(("account",), {'type': str, 'help': "account name"}),
+      (("-c", "--cursor"), {'type': str, 'default': None,
+          'help': "next_cursor of the previous page to continue from"}),
+      (("-l", "--limit"), {'type': int, 'default': 100,
+          'help': "most entries to return (default=100)"}),
+      (("--since",), {'type': float, 'default': None,
+          'help': "only entries at or after this unix time"}),
+      (("--until",), {'type': float, 'default': None,
+          'help': "only entries at or before this unix time"}),
+      (("-t", "--type"), {'type': str, 'action': "append",
+          'choices': ENTRY_TYPES, 'default': None,
+          'help': "only entries of this type, may be given more than once"})]),
+    ('create', {},
+     [(("msatoshis",), {'type': str, 'help': "spending amount in account"}),
+      (("-a", "--account-name"), {'type': str, 'default': "account",
+          'help': "account name base string"}),
+      (("-c", "--cap"), {'type': str, 'default': "none",
+          'help': "cap deposit balance at given msatoshis"})]),
+    ('bulkcreate', {'help': 'create many accounts with the same balance'},
+     [(("count",), {'type': int, 'help': "number of accounts to create"}),
+      (("msatoshis",), {'type': str,
+                        'help': "spending amount in each account"}),
+      (("-a", "--account-name"), {'type': str, 'default': "account",
+          'help': "account name base string"}),
+      (("-c", "--cap"), {'type': str, 'default': "none",
+          'help': "cap deposit balance at given msatoshis"})]),
+    ('rm', {'help': "remove account"},
+     [(("account",), {'type': str, 'help': "account to remove"})]),
+    ('connect', {'help': 'connect to websocket'},
+     [(("account",), {'type': str,
+                      'help': "account or service for connection"}),
+      (("beacon",), {'help': "beacon to connect to"})]),
+    ('listen', {'help': 'listen to websocket'},
+     [(("account",), {'type': str,
+          'help': "account to match with incoming connections"}),
+      (("-s", "--shared-seed"), {'type': str,
+          'help': "shared_seed to listen for account "
+                  "(default=auto-generated)"})]),
+    ('clear', {'help': 'clear connections for account'},
+     [(("account",), {'type': str, 'help': "account to clear"})]),
+    ('profile', {'help': 'profile the running process into LogDir'},
+     [(("action",), {'type': str,
+                     'choices': ["start", "stop", "dump", "status"],
+                     'help': "start or stop a profile, dump what has been "
+                             "collected so far, or show status"}),
+      (("-m", "--mode"), {'type': str, 'choices': PROFILE_MODES,
+          'default': "sampling",
+          'help': "sampling writes collapsed stacks of all threads for "
+                  "flamegraphs, cprofile writes pstats of the reactor "
+                  "thread (default=sampling)"}),
+      (("-s", "--seconds"), {'type': float, 'default': 60.0,
+          'help': "stop by itself after this long (default=60)"}),
+      (("-i", "--interval"), {'type': float, 'default': 5.0,
+          'help': "milliseconds between samples (default=5)"})]),
+]
+
+# commands handled by terminus-cli itself rather than sent to the app
+CLI_COMMANDS = [
+    ('shell', {'help': 'read commands line by line (or as NDJSON) from '
+                       'stdin over one kept-alive connection'}, []),
+]
+
+
 class TerminusCmdParse():
     @staticmethod
-    def get_parser(app=None):
-        parser = argparse.ArgumentParser()
+    def get_parser(app=None, parser_class=argparse.ArgumentParser,
+                   commands=COMMANDS):
+        parser = parser_class()
 
         subparsers = parser.add_subparsers(dest="subparser_name",
                                            title='commands',
                                            description='valid app commands',
                                            help='app commands')
 
-        parser_getinfo = subparsers.add_parser('getinfo',
-                                               help='display summary')
-        if app:
-            parser_getinfo.set_defaults(cmd_func=app.getinfo)
-
-        parser_getaccountinfo = subparsers.add_parser('getaccountinfo',
-            help='get info about a specific set of accounts')
-        parser_getaccountinfo.add_argument("accounts", type=str, nargs='*',
-                                    help="account names to filter results")
-        if app:
-            parser_getaccountinfo.set_defaults(cmd_func=app.getaccountinfo)
-
-        parser_getaccountreceipts = subparsers.add_parser('getaccountreceipts',
-            help='get the transaction receipts of a specific account')
-        parser_getaccountreceipts.add_argument("account", type=str,
-                                               help="account name")
-        if app:
-            parser_getaccountreceipts.set_defaults(
-                cmd_func=app.getaccountreceipts)
-
-        parser_create = subparsers.add_parser("create")
-        parser_create.add_argument("msatoshis", type=str,
-                                   help="spending amount in account")
-        parser_create.add_argument("-a", "--account-name", type=str,
-                                   default="account",
-                                   help="account name base string")
-        parser_create.add_argument("-c", "--cap", type=str, default="none",
-                                   help="cap deposit balance at given msatoshis")
-        if app:
-            parser_create.set_defaults(cmd_func=app.create)
-
-
-        parser_rm = subparsers.add_parser("rm", help="remove account")
-        parser_rm.add_argument("account", type=str,
-                               help="account to remove")
-        if app:
-            parser_rm.set_defaults(cmd_func=app.rm)
-
-        parser_connect = subparsers.add_parser('connect',
-                                               help='connect to websocket')
-        parser_connect.add_argument("account", type=str,
-                                    help="account or service for connection")
-        parser_connect.add_argument("beacon", help="beacon to connect to")
-        if app:
-            parser_connect.set_defaults(cmd_func=app.connect)
-
-
-        parser_listen = subparsers.add_parser('listen',
-                                              help='listen to websocket')
-        parser_listen.add_argument("account", type=str,
-            help="account to match with incoming connections")
-        parser_listen.add_argument('-s', '--shared-seed', type=str,
-            help="shared_seed to listen for account (default=auto-generated)")
-        if app:
-            parser_listen.set_defaults(cmd_func=app.listen)
-
-
-        parser_clear = subparsers.add_parser('clear',
-            help='clear connections for account')
-        parser_clear.add_argument("account", type=str, help="account to clear")
-        if app:
-            parser_clear.set_defaults(cmd_func=app.clear)
-
+        for name, parser_kwargs, arguments in commands:
+            subparser = subparsers.add_parser(name, **parser_kwargs)
+            for flags, kwargs in arguments:
+                subparser.add_argument(*flags, **kwargs)
+            if app:
+                subparser.set_defaults(cmd_func=getattr(app, name))
         return parser
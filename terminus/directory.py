@@ -2,21 +2,28 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
+import bisect
+
 
 class TerminusDirectory(object):
     def __init__(self):
         self.account_by_shared_seed = {}
         self.shared_seeds_by_account = {}
         self.accounts = {}
+        # kept sorted as accounts come and go rather than sorted per call
+        self.account_names = []
 
         self.accounts_by_payment_hash = {}
+        self.payment_hashes_by_account = {}
+        # prefix -> index below which every "<prefix>-<n>" name is taken
+        self.next_name_index = {}
 
     def iter_accounts(self):
-        for account_name in sorted(self.accounts.keys()):
+        for account_name in self.account_names:
             yield self.accounts[account_name]
 
     def get_account_list(self):
-        return list(self.iter_accounts())
+        return [self.accounts[name] for name in self.account_names]
 
     def get_account_name_set(self):
         return set(self.accounts.keys())
@@ -27,7 +34,7 @@ class TerminusDirectory(object):
         return self.accounts[account_name]
 
     def lookup_by_seed(self, shared_seed):
-        return self.account_by_shared_seed[shared_seed]
+        return self.account_by_shared_seed.get(shared_seed)
 
     def lookup_by_payment_hash(self, payment_hash):
         if payment_hash not in self.accounts_by_payment_hash:
@@ -35,30 +42,169 @@ class TerminusDirectory(object):
         return {self.accounts[name] for name in
                 self.accounts_by_payment_hash[payment_hash]}
 
+    ###########################################################################
+
+    def allocate_account_name(self, prefix):
+        # the lowest free "<prefix>-<n>", picking up where the last one for
+        # this prefix left off instead of probing from zero every time
+        i = self.next_name_index.get(prefix, 0)
+        while "%s-%d" % (prefix, i) in self.accounts:
+            i += 1
+        self.next_name_index[prefix] = i + 1
+        return "%s-%d" % (prefix, i)
+
+    def release_account_name(self, name):
+        prefix, _, index = name.rpartition("-")
+        if not index.isdigit() or prefix not in self.next_name_index:
+            return
+        self.next_name_index[prefix] = min(self.next_name_index[prefix],
+                                           int(index))
+
+    ###########################################################################
+
+    def add_shared_seed(self, account, shared_seed):
+        name = account.get_name()
+        if name not in self.shared_seeds_by_account:
+            self.shared_seeds_by_account[name] = set()
+        self.shared_seeds_by_account[name].add(shared_seed)
+        self.account_by_shared_seed[shared_seed] = account
+
+    def remove_shared_seed(self, account, shared_seed):
+        name = account.get_name()
+        shared_seeds = self.shared_seeds_by_account.get(name)
+        if shared_seeds is not None:
+            shared_seeds.discard(shared_seed)
+            if len(shared_seeds) == 0:
+                del self.shared_seeds_by_account[name]
+        if self.account_by_shared_seed.get(shared_seed) is account:
+            del self.account_by_shared_seed[shared_seed]
+
+    def add_pending(self, account, payment_hash):
+        name = account.get_name()
+        if payment_hash not in self.accounts_by_payment_hash:
+            self.accounts_by_payment_hash[payment_hash] = set()
+        self.accounts_by_payment_hash[payment_hash].add(name)
+        if name not in self.payment_hashes_by_account:
+            self.payment_hashes_by_account[name] = set()
+        self.payment_hashes_by_account[name].add(payment_hash)
+
+    def remove_pending(self, account, payment_hash):
+        name = account.get_name()
+        names = self.accounts_by_payment_hash.get(payment_hash)
+        if names is not None:
+            names.discard(name)
+            if len(names) == 0:
+                del self.accounts_by_payment_hash[payment_hash]
+        payment_hashes = self.payment_hashes_by_account.get(name)
+        if payment_hashes is not None:
+            payment_hashes.discard(payment_hash)
+            if len(payment_hashes) == 0:
+                del self.payment_hashes_by_account[name]
+
+    ###########################################################################
+
     def add_account(self, account):
         name = account.get_name()
+        if name in self.accounts:
+            self.reindex_account(account)
+            return
         self.accounts[name] = account
-        shared_seeds = account.get_all_shared_seeds()
-        for shared_seed in shared_seeds:
-            if name not in self.shared_seeds_by_account:
-                self.shared_seeds_by_account[name] = set()
-            self.shared_seeds_by_account[name].add(shared_seed)
-            self.account_by_shared_seed[shared_seed] = account
-
+        bisect.insort(self.account_names, name)
+        for shared_seed in account.get_all_shared_seeds():
+            self.add_shared_seed(account, shared_seed)
         for payment_hash, _ in account.get_pending():
-            if payment_hash not in self.accounts_by_payment_hash:
-                self.accounts_by_payment_hash[payment_hash] = set()
-            self.accounts_by_payment_hash[payment_hash].add(name)
+            self.add_pending(account, payment_hash)
+
+    def add_accounts(self, accounts):
+        # a whole load of accounts at startup, sorting the names once
+        # instead of an insort each
+        for account in accounts:
+            name = account.get_name()
+            if name in self.accounts:
+                self.reindex_account(account)
+                continue
+            self.accounts[name] = account
+            self.account_names.append(name)
+            for shared_seed in account.get_all_shared_seeds():
+                self.add_shared_seed(account, shared_seed)
+            for payment_hash, _ in account.get_pending():
+                self.add_pending(account, payment_hash)
+        self.account_names.sort()
 
     def reindex_account(self, account):
-        self.add_account(account)
+        # bring the indexes in line with the account when the caller didn't
+        # track the individual changes, costs O(account) not O(directory)
+        name = account.get_name()
+        # seeds dropped are still mapped to the object that was indexed,
+        # which needn't be this one
+        indexed = self.accounts.get(name, account)
+        self.accounts[name] = account
+        shared_seeds = set(account.get_all_shared_seeds())
+        indexed_seeds = self.shared_seeds_by_account.get(name, set())
+        for shared_seed in indexed_seeds - shared_seeds:
+            self.remove_shared_seed(indexed, shared_seed)
+        for shared_seed in shared_seeds:
+            self.add_shared_seed(account, shared_seed)
+        payment_hashes = {payment_hash for payment_hash, _ in
+                          account.get_pending()}
+        indexed_hashes = self.payment_hashes_by_account.get(name, set())
+        for payment_hash in indexed_hashes - payment_hashes:
+            self.remove_pending(account, payment_hash)
+        for payment_hash in payment_hashes - indexed_hashes:
+            self.add_pending(account, payment_hash)
 
     def remove_account(self, account):
         name = account.get_name()
         _ = self.accounts.pop(name)
-        shared_seeds = self.shared_seeds_by_account.pop(name, set())
-        for shared_seed in shared_seeds:
-            _ = self.account_by_shared_seed[shared_seed]
+        i = bisect.bisect_left(self.account_names, name)
+        del self.account_names[i]
+        for shared_seed in list(self.shared_seeds_by_account.get(name, ())):
+            self.remove_shared_seed(account, shared_seed)
+        for payment_hash in list(self.payment_hashes_by_account.get(name,
+                                                                    ())):
+            self.remove_pending(account, payment_hash)
+        self.release_account_name(name)
 
-        for payment_hash, _ in account.get_pending():
-            self.accounts_by_payment_hash[payment_hash].remove(name)
+    ###########################################################################
+
+    def check_consistency(self):
+        # compare every index against the state held by the accounts, returns
+        # a list of the problems found
+        problems = []
+        if self.account_names != sorted(self.accounts.keys()):
+            problems.append("sorted account names out of step")
+        seeds_seen = set()
+        hashes_seen = set()
+        for name, account in self.accounts.items():
+            shared_seeds = set(account.get_all_shared_seeds())
+            if shared_seeds != self.shared_seeds_by_account.get(name, set()):
+                problems.append("%s: shared seed set mismatch" % name)
+            for shared_seed in shared_seeds:
+                if self.account_by_shared_seed.get(shared_seed) is not account:
+                    problems.append("%s: seed %s maps elsewhere" %
+                                    (name, shared_seed))
+            seeds_seen |= shared_seeds
+            payment_hashes = {payment_hash for payment_hash, _ in
+                              account.get_pending()}
+            if payment_hashes != self.payment_hashes_by_account.get(name,
+                                                                    set()):
+                problems.append("%s: payment hash set mismatch" % name)
+            for payment_hash in payment_hashes:
+                if name not in self.accounts_by_payment_hash.get(payment_hash,
+                                                                 ()):
+                    problems.append("%s: payment hash %s not indexed" %
+                                    (name, payment_hash))
+            hashes_seen |= payment_hashes
+        for name in self.shared_seeds_by_account.keys():
+            if name not in self.accounts:
+                problems.append("stale shared seeds for %s" % name)
+        for name in self.payment_hashes_by_account.keys():
+            if name not in self.accounts:
+                problems.append("stale payment hashes for %s" % name)
+        for shared_seed in self.account_by_shared_seed.keys():
+            if shared_seed not in seeds_seen:
+                problems.append("stale shared seed %s" % shared_seed)
+        for payment_hash in self.accounts_by_payment_hash.keys():
+            if payment_hash not in hashes_seen:
+                problems.append("stale payment hash %s" % payment_hash)
+        return problems
@@ -0,0 +1,52 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import heapq
+
+from twisted.internet import reactor
+
+
+class PendingExpiry(object):
+    """ Min-heap of pending invoice expiry times across all accounts with a
+    single callLater armed for the earliest one. Invoices that get paid are
+    not dug out of the heap, the expired callback is expected to ignore
+    entries that are no longer pending. """
+    def __init__(self, expired_cb):
+        self.expired_cb = expired_cb
+        self.heap = []
+        self.timer = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, expires_at, account_name, payment_hash):
+        heapq.heappush(self.heap, (expires_at, account_name, payment_hash))
+        if self.heap[0][0] == expires_at:
+            self.arm()
+
+    def arm(self):
+        if len(self.heap) == 0:
+            if self.timer and self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+            return
+        delay = max(0, self.heap[0][0] - time.time())
+        if self.timer and self.timer.active():
+            self.timer.reset(delay)
+        else:
+            self.timer = reactor.callLater(delay, self.fire)
+
+    def fire(self):
+        self.timer = None
+        now = time.time()
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            _, account_name, payment_hash = heapq.heappop(self.heap)
+            self.expired_cb(account_name, payment_hash)
+        self.arm()
+
+    def stop(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
@@ -0,0 +1,212 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import uuid
+import logging
+
+
+def legacy_receipt_records(legacy_receipts):
+    # the old in-file layout is newest-first for both sessions and entries
+    for session in reversed(legacy_receipts):
+        session_id = str(uuid.uuid4())
+        for entry in reversed(session):
+            yield session_id, entry
+
+
+class JsonAccountStore(object):
+    """ One <account>.json file per account holding the mutable state plus an
+    append-only <account>.receipts.jsonl journal of receipt entries. """
+    def __init__(self, persist_dir):
+        self.persist_dir = persist_dir
+        if not os.path.exists(self.persist_dir):
+            os.makedirs(self.persist_dir)
+
+    def __str__(self):
+        return "json store: %s" % self.persist_dir
+
+    ###########################################################################
+
+    def account_filename(self, account_name):
+        return os.path.join(self.persist_dir, "%s.json" % account_name)
+
+    def receipts_filename(self, account_name):
+        return os.path.join(self.persist_dir,
+                            "%s.receipts.jsonl" % account_name)
+
+    ###########################################################################
+
+    def write_file_synced(self, path, content, mode):
+        f = open(path, mode)
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        return len(content)
+
+    def append_lines_synced(self, path, content):
+        # a crash mid-append can leave a torn last line with no newline, cut
+        # it off first so the lines written now don't get glued onto it
+        f = open(path, 'a+b')
+        end = f.seek(0, os.SEEK_END)
+        if end > 0:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                torn_at = self.last_line_start(f, end)
+                logging.error("dropping torn line at %d of %s" % (torn_at,
+                                                                   path))
+                f.truncate(torn_at)
+        f.write(content.encode("utf8"))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        return len(content)
+
+    def last_line_start(self, f, end):
+        pos = end
+        while pos > 0:
+            step = min(pos, 4096)
+            pos -= step
+            f.seek(pos)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                return pos + i + 1
+        return 0
+
+    def sync_dir(self):
+        fd = os.open(self.persist_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read_json(self, path):
+        f = open(path, 'r')
+        c = f.read()
+        info = json.loads(c)
+        f.close()
+        return info
+
+    def journal_lines(self, receipt_records):
+        return "".join(json.dumps({'session': session_id, 'entry': entry}) +
+                       "\n" for session_id, entry in receipt_records)
+
+    ###########################################################################
+
+    def iter_account_names(self):
+        for f in os.listdir(self.persist_dir):
+            if f.endswith(".json"):
+                yield f[:-5]
+
+    def iter_account_records(self):
+        for account_name in self.iter_account_names():
+            yield self.read_account(account_name)
+
+    def iter_account_mtimes(self):
+        # (account name, modification time of its file)
+        for entry in os.scandir(self.persist_dir):
+            if entry.name.endswith(".json"):
+                yield entry.name[:-5], entry.stat().st_mtime
+
+    def has_account(self, account_name):
+        return os.path.exists(self.account_filename(account_name))
+
+    def read_account(self, account_name):
+        return self.read_json(self.account_filename(account_name))
+
+    def create_account(self, record):
+        self.commit([(record['account_name'], record, [])])
+
+    def remove_account(self, account_name):
+        # an account created and removed between flushes never got a file
+        filename = self.account_filename(account_name)
+        if os.path.exists(filename):
+            os.remove(filename)
+        receipts_filename = self.receipts_filename(account_name)
+        if os.path.exists(receipts_filename):
+            os.remove(receipts_filename)
+
+    ###########################################################################
+
+    def iter_receipt_records(self, account_name):
+        path = self.receipts_filename(account_name)
+        if not os.path.exists(path):
+            return
+        f = open(path, 'r')
+        for n, line in enumerate(f):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a torn final line from a crash mid-append
+                logging.error("skipping bad receipt journal line %d in %s" %
+                              (n, path))
+                continue
+            if 'base_seq' in record:
+                continue
+            yield record['session'], record['entry']
+        f.close()
+
+    def replace_receipt_records(self, account_name, receipt_records):
+        path = self.receipts_filename(account_name)
+        self.write_file_synced(path + ".tmp",
+                               self.journal_lines(receipt_records), 'w')
+        os.replace(path + ".tmp", path)
+        self.sync_dir()
+
+    def get_receipt_base_seq(self, account_name):
+        # a journal that has had entries archived starts with a line holding
+        # the seq of its first entry
+        path = self.receipts_filename(account_name)
+        if not os.path.exists(path):
+            return 0
+        f = open(path, 'r')
+        line = f.readline()
+        f.close()
+        try:
+            return json.loads(line).get('base_seq', 0)
+        except ValueError:
+            return 0
+
+    def archive_receipt_records(self, account_name, count, base_seq):
+        # drop the oldest count records, now kept in an archive segment. The
+        # new base is written with the rest so the two can't disagree.
+        records = list(self.iter_receipt_records(account_name))[count:]
+        path = self.receipts_filename(account_name)
+        self.write_file_synced(path + ".tmp",
+                               json.dumps({'base_seq': base_seq}) + "\n" +
+                               self.journal_lines(records), 'w')
+        os.replace(path + ".tmp", path)
+        self.sync_dir()
+
+    ###########################################################################
+
+    def commit(self, changes, appended_cb=None):
+        # write every changed account file to a temp file and fsync it,
+        # rename them all into place, append the receipt journals and then
+        # fsync the directory once for the whole batch. Returns the bytes
+        # written. Rewriting a header is harmless but a journal append
+        # isn't, appended_cb is called with each account whose journal has
+        # been appended to so a retry after a later failure leaves it out.
+        written = 0
+        renames = []
+        for account_name, record, _ in changes:
+            if record is None:
+                continue
+            filename = self.account_filename(account_name)
+            written += self.write_file_synced(filename + ".tmp",
+                                              json.dumps(record), 'w')
+            renames.append(filename)
+        for filename in renames:
+            os.replace(filename + ".tmp", filename)
+        for account_name, _, receipt_records in changes:
+            if len(receipt_records) == 0:
+                continue
+            written += self.append_lines_synced(
+                self.receipts_filename(account_name),
+                self.journal_lines(receipt_records))
+            if appended_cb:
+                appended_cb(account_name)
+        self.sync_dir()
+        return written
@@ -0,0 +1,234 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import bisect
+
+from twisted.internet import task
+from twisted.web import resource
+
+
+# seconds, from a fast local call to a slow multi-hop payment
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LAG_INTERVAL = 1.0
+
+
+class Metric(object):
+    """ Values kept per tuple of label values, rendered on scrape. Recording
+    is a dict update so it costs next to nothing when nobody scrapes. """
+    TYPE = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    @staticmethod
+    def escape_label(value):
+        # backslash first so the ones added for the others aren't doubled
+        return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+                .replace('"', '\\"'))
+
+    def fmt_labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, Metric.escape_label(v))
+                                 for k, v in pairs)
+
+    def iter_samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, self.fmt_labels(labels), value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text),
+                 "# TYPE %s %s" % (self.name, self.TYPE)]
+        for name, labels, value in self.iter_samples():
+            lines.append("%s%s %s" % (name, labels, repr(float(value))))
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, labelnames)
+        # worked out at scrape time instead of tracked on every change
+        self.func = func
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def iter_samples(self):
+        if self.func is not None:
+            self.values = {(): self.func()}
+        return super().iter_samples()
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            # one count per bucket plus +Inf, then sum
+            counts = [0] * (len(self.buckets) + 1) + [0.0]
+            self.values[labels] = counts
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def iter_samples(self):
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (self.name + "_bucket",
+                       self.fmt_labels(labels, [("le", le)]), cumulative)
+            yield self.name + "_count", self.fmt_labels(labels), cumulative
+            yield self.name + "_sum", self.fmt_labels(labels), counts[-1]
+
+
+###############################################################################
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), func=None):
+        return self.add(Gauge(name, help_text, labelnames, func=func))
+
+    def histogram(self, name, help_text, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, labelnames,
+                                  buckets=buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_REQUESTS = REGISTRY.counter(
+    "terminus_handler_requests_total",
+    "provider and node events handled, by handler and outcome",
+    ["handler", "outcome"])
+HANDLER_SECONDS = REGISTRY.histogram(
+    "terminus_handler_seconds",
+    "reactor time spent in a handler, not counting backend calls",
+    ["handler"])
+LIGHTNING_SECONDS = REGISTRY.histogram(
+    "terminus_lightning_call_seconds",
+    "lightning backend call latency including time queued for a thread",
+    ["call", "outcome"])
+PERSIST_SECONDS = REGISTRY.histogram(
+    "terminus_persist_seconds",
+    "time to durably write one batch of account changes")
+PERSIST_BYTES = REGISTRY.counter(
+    "terminus_persist_bytes_total",
+    "bytes of account state and receipts written")
+PERSIST_ACCOUNTS = REGISTRY.histogram(
+    "terminus_persist_batch_accounts",
+    "accounts written per persist batch",
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000, 5000))
+PERSIST_FAILURES = REGISTRY.counter(
+    "terminus_persist_failures_total",
+    "persist batches that failed and were retried")
+BOLT11_LOOKUPS = REGISTRY.counter(
+    "terminus_bolt11_cache_lookups_total",
+    "decoded invoice cache lookups, by hit or miss",
+    ["result"])
+SETTLEMENT_BATCH = REGISTRY.histogram(
+    "terminus_settlement_batch_payments",
+    "received payments settled together in one reactor turn",
+    buckets=(1, 2, 5, 10, 50, 100, 500, 1000))
+RPC_SECONDS = REGISTRY.histogram(
+    "terminus_rpc_seconds",
+    "RPC command handling time",
+    ["command"])
+REACTOR_LAG = REGISTRY.histogram(
+    "terminus_reactor_lag_seconds",
+    "how late a timer scheduled every %.0fs fired" % LAG_INTERVAL)
+# the app hands these their func, they are only worked out on a scrape
+ACCOUNTS = REGISTRY.gauge(
+    "terminus_accounts",
+    "accounts in the directory")
+PENDING_INVOICES = REGISTRY.gauge(
+    "terminus_pending_invoices",
+    "invoices handed out and not yet paid or expired")
+CONNECTED_SEEDS = REGISTRY.gauge(
+    "terminus_connected_seeds",
+    "shared seeds with an announced provider connection")
+
+
+class Timer(object):
+    """ Wall clock since construction, observed into a histogram. """
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def observe(self, histogram, *labels):
+        histogram.observe(self.elapsed(), *labels)
+
+
+def handled(timer, handler, outcome):
+    HANDLER_REQUESTS.inc(handler, outcome)
+    timer.observe(HANDLER_SECONDS, handler)
+
+
+###############################################################################
+
+class ReactorLagMonitor(object):
+    def __init__(self):
+        self.expected = None
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self):
+        self.expected = time.monotonic() + LAG_INTERVAL
+        self.loop.start(LAG_INTERVAL, now=False)
+
+    def tick(self):
+        now = time.monotonic()
+        REACTOR_LAG.observe(max(0.0, now - self.expected))
+        self.expected = now + LAG_INTERVAL
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b"content-type",
+                          b"text/plain; version=0.0.4; charset=utf-8")
+        return REGISTRY.render().encode("utf8")
@@ -0,0 +1,78 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import logging
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+from terminus.metrics import PERSIST_FAILURES
+
+
+RETRY_SECONDS = 1.0
+
+
+class PersistQueue(object):
+    """ Coalesces writes of dirty account dbs into one batch per reactor tick
+    (or per interval). barrier() hands back a Deferred that fires once
+    everything dirty at the time of the call is durably on disk. """
+    def __init__(self, writer, interval=0):
+        self.writer = writer
+        self.interval = interval
+        self.dirty = {}
+        self.waiters = []
+        self.flush_call = None
+
+    ###########################################################################
+
+    def mark_dirty(self, account_db):
+        self.dirty[account_db] = None
+        if not self.flush_call:
+            self.schedule(self.interval)
+
+    def discard(self, account_db):
+        _ = self.dirty.pop(account_db, None)
+
+    def barrier(self):
+        if len(self.dirty) == 0:
+            return succeed(None)
+        d = Deferred()
+        self.waiters.append(d)
+        # somebody is waiting on us, don't sit out the rest of the interval
+        self.schedule(0)
+        return d
+
+    ###########################################################################
+
+    def schedule(self, delay):
+        if self.flush_call:
+            if self.flush_call.getTime() <= reactor.seconds() + delay:
+                return
+            self.flush_call.cancel()
+        self.flush_call = reactor.callLater(delay, self.flush)
+
+    def flush(self):
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if len(self.dirty) == 0:
+            return
+        account_dbs = list(self.dirty.keys())
+        self.dirty = {}
+        waiters = self.waiters
+        self.waiters = []
+        try:
+            self.writer(account_dbs)
+        except Exception as e:
+            logging.exception("could not persist %d accounts: %s" %
+                              (len(account_dbs), e))
+            PERSIST_FAILURES.inc()
+            # keep everything (and everybody waiting) for the next attempt
+            for account_db in account_dbs:
+                self.dirty[account_db] = None
+            self.waiters = waiters + self.waiters
+            self.schedule(RETRY_SECONDS)
+            return
+        for d in waiters:
+            d.callback(None)
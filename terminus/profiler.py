@@ -0,0 +1,147 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import sys
+import time
+import cProfile
+import datetime
+import logging
+import threading
+
+from twisted.internet import reactor
+
+
+MODES = ["sampling", "cprofile"]
+
+
+class StackSampler(object):
+    """ Samples the stacks of every thread but its own from a background
+    thread and counts them in collapsed form, one
+    "thread;outer;...;inner count" line per distinct stack, which is what
+    flamegraph.pl and speedscope read. Costs the profiled threads nothing
+    beyond the GIL hand-offs. """
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run,
+                                       name="terminus-profiler", daemon=True)
+
+    def frame_name(self, frame):
+        code = frame.f_code
+        return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+    def sample(self, own_ident):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            key = ";".join(reversed(stack))
+            with self.lock:
+                self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def run(self):
+        own_ident = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            self.sample(own_ident)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with self.lock:
+            counts = dict(self.counts)
+        f = open(path, 'w')
+        for stack, count in sorted(counts.items()):
+            f.write("%s %d\n" % (stack, count))
+        f.close()
+
+
+class TerminusProfiler(object):
+    """ Runs one profiler at a time inside the live process for a bounded
+    window, writing its output under the log directory. cprofile sees only
+    the reactor thread, sampling sees every thread. """
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.mode = None
+        self.profiler = None
+        self.started_at = None
+        self.stop_call = None
+
+    def is_running(self):
+        return self.mode is not None
+
+    def output_path(self):
+        now = datetime.datetime.now().strftime("%y%m%d-%H.%M.%S")
+        ext = "pstats" if self.mode == "cprofile" else "collapsed"
+        return os.path.join(self.log_dir,
+                            "terminus-profile-%s.%s" % (now, ext))
+
+    ###########################################################################
+
+    def start(self, mode, seconds, interval):
+        self.mode = mode
+        self.started_at = time.time()
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = StackSampler(interval)
+            self.profiler.start()
+        self.stop_call = reactor.callLater(seconds, self.stop)
+        logging.info("started %s profiler for %.1f seconds" % (mode,
+                                                                seconds))
+
+    def write_output(self):
+        path = self.output_path()
+        if self.mode == "cprofile":
+            # dump_stats() disables the profiler on the way
+            self.profiler.dump_stats(path)
+        else:
+            self.profiler.write(path)
+        logging.info("wrote %s profile: %s" % (self.mode, path))
+        return path
+
+    def dump(self):
+        # what has been collected so far, and carry on
+        path = self.write_output()
+        if self.mode == "cprofile":
+            self.profiler.enable()
+        return path
+
+    def stop(self):
+        if self.stop_call and self.stop_call.active():
+            self.stop_call.cancel()
+        self.stop_call = None
+        if self.mode == "sampling":
+            self.profiler.stop()
+        path = self.write_output()
+        seconds = time.time() - self.started_at
+        self.mode = None
+        self.profiler = None
+        return path, seconds
+
+    def status(self):
+        if not self.is_running():
+            return {'running': False}
+        info = {'running':   True,
+                'mode':      self.mode,
+                'seconds':   time.time() - self.started_at,
+                'remaining': self.stop_call.getTime() - reactor.seconds()}
+        if self.mode == "sampling":
+            info['samples'] = self.profiler.samples
+        return info
@@ -4,10 +4,33 @@
 
 import time
 import uuid
+import heapq
+import bisect
+from array import array
 
 from moneysocket.wad.wad import Wad
 
 
+ENTRY_TYPES = ['session_start', 'invoice_request', 'pay_request',
+               'preimage_notified', 'invoice_notified', 'error_notified',
+               'session_end']
+TYPE_CODES = {t: code for code, t in enumerate(ENTRY_TYPES)}
+
+# the keys of each entry type beyond 'type' and 'time', in order. At most
+# one of them is a string, kept as the entry's text.
+ENTRY_FIELDS = {'session_start':     (),
+                'invoice_request':   ('wad',),
+                'pay_request':       ('wad', 'bolt11'),
+                'preimage_notified': ('preimage', 'increment', 'wad'),
+                'invoice_notified':  ('bolt11',),
+                'error_notified':    ('error',),
+                'session_end':       ()}
+TEXT_FIELDS = {'pay_request':       'bolt11',
+               'preimage_notified': 'preimage',
+               'invoice_notified':  'bolt11',
+               'error_notified':    'error'}
+
+
 class SocketSessionReceipt():
     @staticmethod
     def new_session(shared_seeed):
@@ -71,3 +94,124 @@ class SocketSessionReceipt():
                  'time':  time.time()}
         return entry
 
+
+
+class ReceiptIndex(object):
+    """ The receipt entries of one account in journal order, addressed by a
+    sequence number that stays stable for the life of the account. Keeps the
+    entry times and per-type position lists alongside so a page of results
+    costs O(log n + page) whatever the size of the history. Entry times are
+    taken to be ascending in journal order.
+
+    Entries are held in columns rather than as dicts: a type code, the time,
+    the msats of the wad and the one string field the type has, with the
+    dict (and its Wad) only built again for the entries a query returns.
+    Entries that don't fit their type's fields are kept whole. """
+    def __init__(self, base_seq=0):
+        self.base_seq = base_seq
+        self.sessions = []
+        # one string object per session id, not one per entry read
+        self.session_ids = {}
+        self.types = array('B')
+        self.times = array('d')
+        self.msats = array('q')
+        self.increments = array('B')
+        self.texts = []
+        self.whole = {}
+        self.positions_by_type = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def next_seq(self):
+        return self.base_seq + len(self.times)
+
+    def fits(self, entry):
+        fields = ENTRY_FIELDS.get(entry['type'])
+        if fields is None or len(entry) != len(fields) + 2:
+            return False
+        for field in fields:
+            if field not in entry:
+                return False
+        if 'wad' in fields:
+            wad = entry['wad']
+            if (not isinstance(wad, dict) or wad.get('asset_stable', True)
+                    or not isinstance(wad.get('msats'), int)):
+                return False
+        return True
+
+    def append(self, session_id, entry):
+        position = len(self.times)
+        self.sessions.append(self.session_ids.setdefault(session_id,
+                                                         session_id))
+        entry_type = entry['type']
+        self.times.append(entry['time'])
+        if self.fits(entry):
+            self.types.append(TYPE_CODES[entry_type])
+            self.msats.append(entry['wad']['msats'] if 'wad' in entry else 0)
+            self.increments.append(1 if entry.get('increment') else 0)
+            text_field = TEXT_FIELDS.get(entry_type)
+            self.texts.append(entry[text_field] if text_field else None)
+        else:
+            self.types.append(TYPE_CODES.get(entry_type, 0))
+            self.msats.append(0)
+            self.increments.append(0)
+            self.texts.append(None)
+            self.whole[position] = entry
+        if entry_type not in self.positions_by_type:
+            self.positions_by_type[entry_type] = array('q')
+        self.positions_by_type[entry_type].append(position)
+
+    def entry(self, position):
+        if position in self.whole:
+            return self.whole[position]
+        entry_type = ENTRY_TYPES[self.types[position]]
+        entry = {'type': entry_type,
+                 'time': self.times[position]}
+        for field in ENTRY_FIELDS[entry_type]:
+            if field == 'wad':
+                entry['wad'] = Wad.bitcoin(self.msats[position])
+            elif field == 'increment':
+                entry['increment'] = self.increments[position] == 1
+            else:
+                entry[field] = self.texts[position]
+        return entry
+
+    def iter_records(self, start, end):
+        # (session_id, entry) as they were appended
+        for position in range(start, end):
+            yield self.sessions[position], self.entry(position)
+
+    ###########################################################################
+
+    def iter_positions_down(self, end, entry_types):
+        # positions below end, newest first, optionally of the given types
+        if entry_types is None:
+            return iter(range(end - 1, -1, -1))
+        def walk_down(positions):
+            i = bisect.bisect_left(positions, end)
+            for j in range(i - 1, -1, -1):
+                yield positions[j]
+        walks = [walk_down(self.positions_by_type[t]) for t in entry_types if
+                 t in self.positions_by_type]
+        return heapq.merge(*walks, reverse=True)
+
+    def query(self, cursor=None, limit=100, since=None, until=None,
+              entry_types=None):
+        # newest first, starting below the seq given as cursor. Returns the
+        # page of (seq, session_id, entry) and the cursor for the next page,
+        # None when there is nothing more.
+        end = len(self.times)
+        if cursor is not None:
+            end = max(0, min(end, cursor - self.base_seq))
+        if until is not None:
+            end = min(end, bisect.bisect_right(self.times, until))
+        page = []
+        for position in self.iter_positions_down(end, entry_types):
+            if since is not None and self.times[position] < since:
+                break
+            if len(page) == limit:
+                return page, page[-1][0]
+            page.append((self.base_seq + position, self.sessions[position],
+                         self.entry(position)))
+        return page, None
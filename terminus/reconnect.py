@@ -0,0 +1,136 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import time
+import random
+from collections import deque
+
+from twisted.internet import reactor
+
+
+BASE_DELAY = 1.0
+MAX_DELAY = 300.0
+# how soon to look at an outgoing attempt that is still in progress
+CHECK_DELAY = 5.0
+# how often to look at an outgoing websocket that is up but hasn't been
+# announced, there is no revoke event for it going away
+IDLE_CHECK_DELAY = 60.0
+
+
+class ReconnectScheduler(object):
+    """ Reconnect timers per connection keyed by shared seed, with capped
+    exponential backoff and jitter, feeding a single queue that is drained
+    under a global connects-per-second limit. Connections that are up have
+    no timer at all, they get back in here through disconnected().
+
+    reconnect_cb(key) makes the connection attempt, state_cb(key) reports
+    'connected', 'connecting', 'disconnected' for an outgoing attempt or None
+    if the key is no longer wanted. """
+    def __init__(self, reconnect_cb, state_cb, connects_per_second):
+        self.reconnect_cb = reconnect_cb
+        self.state_cb = state_cb
+        self.rate = connects_per_second
+        self.tokens = connects_per_second
+        self.token_time = time.time()
+        self.failures = {}
+        self.timers = {}
+        self.queue = deque()
+        self.queued = set()
+        self.drain_call = None
+
+    ###########################################################################
+
+    def set_timer(self, key, delay, func):
+        self.cancel_timer(key)
+        self.timers[key] = reactor.callLater(delay, func, key)
+
+    def cancel_timer(self, key):
+        timer = self.timers.pop(key, None)
+        if timer and timer.active():
+            timer.cancel()
+
+    def backoff(self, key):
+        delay = min(MAX_DELAY, BASE_DELAY * (2 ** self.failures.get(key, 0)))
+        # half fixed, half random so that everybody behind a relay that comes
+        # back doesn't return at the same moment
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    ###########################################################################
+
+    def watch(self, key):
+        # an outgoing connection attempt was just made, look at how it went
+        self.set_timer(key, CHECK_DELAY, self.check)
+
+    def connected(self, key):
+        _ = self.failures.pop(key, None)
+        self.cancel_timer(key)
+        self.queued.discard(key)
+
+    def disconnected(self, key):
+        self.failures[key] = min(self.failures.get(key, 0) + 1, 32)
+        self.set_timer(key, self.backoff(key), self.enqueue)
+
+    def forget(self, key):
+        _ = self.failures.pop(key, None)
+        self.cancel_timer(key)
+        self.queued.discard(key)
+
+    ###########################################################################
+
+    def check(self, key):
+        _ = self.timers.pop(key, None)
+        state = self.state_cb(key)
+        if state is None:
+            self.forget(key)
+        elif state == "disconnected":
+            self.disconnected(key)
+        elif state == "connected":
+            self.set_timer(key, IDLE_CHECK_DELAY, self.check)
+        else:
+            self.set_timer(key, CHECK_DELAY, self.check)
+
+    def enqueue(self, key):
+        _ = self.timers.pop(key, None)
+        if key in self.queued:
+            return
+        self.queued.add(key)
+        self.queue.append(key)
+        self.drain()
+
+    def take_token(self):
+        now = time.time()
+        self.tokens = min(self.rate,
+                          self.tokens + (now - self.token_time) * self.rate)
+        self.token_time = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        if self.drain_call and self.drain_call.active():
+            return
+        self.drain_call = None
+        while len(self.queue) > 0:
+            key = self.queue[0]
+            if key not in self.queued:
+                # forgotten or connected while it waited
+                self.queue.popleft()
+                continue
+            wait = self.take_token()
+            if wait > 0:
+                self.drain_call = reactor.callLater(wait, self.drain)
+                return
+            self.queue.popleft()
+            self.queued.discard(key)
+            self.reconnect_cb(key)
+
+    ###########################################################################
+
+    def stop(self):
+        for key in list(self.timers.keys()):
+            self.cancel_timer(key)
+        if self.drain_call and self.drain_call.active():
+            self.drain_call.cancel()
+        self.drain_call = None
@@ -3,61 +3,250 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php
 
 import json
+import logging
+import argparse
+from twisted.web import server
 from txjsonrpc.web import jsonrpc
-from terminus.cmd_parse import TerminusCmdParse
+
+from terminus.account_db import AccountDb
+from terminus.metrics import Timer, RPC_SECONDS
+from terminus.cmd_parse import TerminusCmdParse, COMMANDS
+
+
+# JSON-RPC 2.0 error codes
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+class RpcParamError(Exception):
+    pass
+
+
+class RpcArgumentParser(argparse.ArgumentParser):
+    # argparse exits the process on bad input, which is no good in a server
+    def error(self, message):
+        raise RpcParamError(message)
+
+    def exit(self, status=0, message=None):
+        raise RpcParamError(message or "exit requested")
+
+
+class RpcParam(object):
+    """ One argument of a command as a named JSON-RPC param, taken from the
+    same definition the argparse subparser is built from. """
+    def __init__(self, flags, kwargs):
+        self.positional = not flags[0].startswith("-")
+        self.name = kwargs.get('dest',
+                               flags[-1].lstrip("-").replace("-", "_"))
+        self.nargs = kwargs.get('nargs')
+        self.many = (self.nargs in {'*', '+'} or
+                     kwargs.get('action') == "append")
+        self.required = self.positional and self.nargs not in {'*', '?'}
+        self.convert = kwargs.get('type', str)
+        self.choices = kwargs.get('choices')
+        self.default = kwargs.get('default', [] if self.nargs == '*' else
+                                  None)
+
+    def convert_one(self, value):
+        try:
+            value = self.convert(value)
+        except (TypeError, ValueError):
+            raise RpcParamError("bad value for %s: %s" % (self.name, value))
+        if self.choices is not None and value not in self.choices:
+            raise RpcParamError("%s must be one of: %s" % (
+                self.name, ", ".join(self.choices)))
+        return value
+
+    def parse(self, value):
+        if not self.many:
+            return self.convert_one(value)
+        if not isinstance(value, list):
+            value = [value]
+        return [self.convert_one(v) for v in value]
+
 
 class TerminusRpc(jsonrpc.JSONRPC):
     APP = None
+    # built once by setup() rather than per request
+    PARSER = None
+    DISPATCH = {}
+    COMPACT = False
+
+    @staticmethod
+    def setup(app, compact=False):
+        TerminusRpc.APP = app
+        TerminusRpc.COMPACT = compact
+        TerminusRpc.PARSER = TerminusCmdParse.get_parser(
+            app=app, parser_class=RpcArgumentParser)
+        TerminusRpc.DISPATCH = {
+            name: (getattr(app, name),
+                   [RpcParam(flags, kwargs) for flags, kwargs in arguments])
+            for name, _, arguments in COMMANDS}
 
-    def exec_cmd(self, name, *args):
-        parser = TerminusCmdParse.get_parser(app=self.APP)
-        #print("args: %s" % args)
-        #print("name: %s" % name)
+    ###########################################################################
+
+    def encode(self, info):
+        if TerminusRpc.COMPACT:
+            return json.dumps(info, separators=(",", ":"))
+        return json.dumps(info, indent=1, sort_keys=True)
+
+    def parse_named(self, name, params):
+        _, rpc_params = TerminusRpc.DISPATCH[name]
+        known = {p.name for p in rpc_params}
+        unknown = set(params.keys()) - known
+        if len(unknown) > 0:
+            raise RpcParamError("unknown params: %s" %
+                                ", ".join(sorted(unknown)))
+        values = {}
+        for p in rpc_params:
+            if p.name not in params:
+                if p.required:
+                    raise RpcParamError("missing param: %s" % p.name)
+                values[p.name] = p.default
+                continue
+            values[p.name] = p.parse(params[p.name])
+        return argparse.Namespace(**values)
+
+    def parse_positional(self, name, args):
+        # the CLI sends its command line words, possibly nested in a list
         toparse = [name]
         for a in args:
-            #print("arg: %s " % str(a))
-            if isinstance(a, str):
-                #print("1")
-                toparse.extend(a)
-            elif isinstance(a, list):
-                #print("2")
-                toparse += a
-            elif isinstance(a, tuple):
-                #print("3")
-                for t in a:
-                    #print("4")
-                    if isinstance(t, list):
-                        toparse += t
-                    else:
-                        toparse += [t]
-        #toparse.extend(list(args))
-        #print("toparse: %s" % toparse)
-        parsed = parser.parse_args(toparse)
-        # TODO - handle failed parse natively
-        #print("parsed: %s" % parsed)
-        info = parsed.cmd_func(parsed)
-        return json.dumps(info, indent=1, sort_keys=True)
+            if isinstance(a, (list, tuple)):
+                toparse += [str(t) for t in a]
+            else:
+                toparse.append(str(a))
+        return TerminusRpc.PARSER.parse_args(toparse)
+
+    def dispatch(self, name, args, kwargs):
+        timer = Timer()
+        cmd_func, _ = TerminusRpc.DISPATCH[name]
+        try:
+            parsed = (self.parse_named(name, kwargs) if kwargs else
+                      self.parse_positional(name, args))
+        except RpcParamError as e:
+            return {'success': False, 'error': "*** %s: %s" % (name, e)}
+        info = cmd_func(parsed)
+        timer.observe(RPC_SECONDS, name)
+        return info
+
+    def exec_cmd(self, name, args, kwargs):
+        info = self.dispatch(name, args, kwargs)
+        # reply once whatever the command changed is on disk
+        d = AccountDb.barrier()
+        d.addCallback(lambda _: self.encode(info))
+        return d
+
+    ###########################################################################
+
+    def render(self, request):
+        # a JSON array is a batch, anything else is left to txjsonrpc
+        request.content.seek(0, 0)
+        try:
+            batch = json.loads(request.content.read())
+        except ValueError:
+            batch = None
+        if not isinstance(batch, list):
+            request.content.seek(0, 0)
+            return super().render(request)
+        # fires on finish() or errs if the client goes away first, either way
+        # there's nobody left to answer once it has been called
+        done = request.notifyFinish()
+        done.addErrback(lambda _: None)
+        responses = self.exec_batch(batch)
+        # answer once the mutations of the whole batch are on disk, they go
+        # out together in a single flush
+        d = AccountDb.barrier()
+        d.addCallback(lambda _: self.finish_batch(request, done, responses))
+        d.addErrback(self.batch_failed, request, done)
+        return server.NOT_DONE_YET
+
+    def exec_batch(self, batch):
+        # run in order within this reactor turn, a failing item doesn't stop
+        # the ones after it
+        if len(batch) == 0:
+            return [self.batch_error(None, INVALID_REQUEST, "empty batch")]
+        responses = []
+        for item in batch:
+            if not isinstance(item, dict) or "method" not in item:
+                responses.append(self.batch_error(None, INVALID_REQUEST,
+                                                  "invalid request"))
+                continue
+            call_id = item.get("id")
+            response = self.exec_batch_item(item, call_id)
+            # no id means a notification, which gets no response
+            if call_id is not None:
+                responses.append(response)
+        return responses
+
+    def exec_batch_item(self, item, call_id):
+        name = item["method"]
+        if name not in TerminusRpc.DISPATCH:
+            return self.batch_error(call_id, METHOD_NOT_FOUND,
+                                    "method not found: %s" % name)
+        params = item.get("params", [])
+        if isinstance(params, dict):
+            args, kwargs = (), params
+        elif isinstance(params, list):
+            args, kwargs = params, {}
+        else:
+            return self.batch_error(call_id, INVALID_REQUEST,
+                                    "params must be an array or object")
+        try:
+            info = self.dispatch(name, args, kwargs)
+        except Exception as e:
+            logging.exception("batch call %s failed" % name)
+            return self.batch_error(call_id, INTERNAL_ERROR, str(e))
+        # encoded the same as the result of a single call
+        return {'jsonrpc': "2.0", 'id': call_id, 'result': self.encode(info)}
+
+    def batch_error(self, call_id, code, message):
+        return {'jsonrpc': "2.0", 'id': call_id,
+                'error': {'code': code, 'message': message}}
+
+    def finish_batch(self, request, done, responses):
+        if done.called:
+            return
+        request.setHeader("content-type", "application/json")
+        if len(responses) > 0:
+            request.write(self.encode(responses).encode("utf8"))
+        request.finish()
+
+    def batch_failed(self, failure, request, done):
+        logging.error("batch failed: %s" % failure.getErrorMessage())
+        if done.called:
+            return
+        request.setResponseCode(500)
+        request.finish()
+
+    ###########################################################################
+
+    def jsonrpc_getinfo(self, *args, **kwargs):
+        return self.exec_cmd('getinfo', args, kwargs)
+
+    def jsonrpc_getaccountinfo(self, *args, **kwargs):
+        return self.exec_cmd('getaccountinfo', args, kwargs)
 
-    def jsonrpc_getinfo(self, *args):
-        return self.exec_cmd('getinfo', args)
+    def jsonrpc_getaccountreceipts(self, *args, **kwargs):
+        return self.exec_cmd('getaccountreceipts', args, kwargs)
 
-    def jsonrpc_getaccountinfo(self, *args):
-        return self.exec_cmd('getaccountinfo', args)
+    def jsonrpc_create(self, *args, **kwargs):
+        return self.exec_cmd('create', args, kwargs)
 
-    def jsonrpc_getaccountreceipts(self, *args):
-        return self.exec_cmd('getaccountreceipts', args)
+    def jsonrpc_bulkcreate(self, *args, **kwargs):
+        return self.exec_cmd('bulkcreate', args, kwargs)
 
-    def jsonrpc_create(self, *args):
-        return self.exec_cmd('create', args)
+    def jsonrpc_rm(self, *args, **kwargs):
+        return self.exec_cmd('rm', args, kwargs)
 
-    def jsonrpc_rm(self, *args):
-        return self.exec_cmd('rm', args)
+    def jsonrpc_connect(self, *args, **kwargs):
+        return self.exec_cmd('connect', args, kwargs)
 
-    def jsonrpc_connect(self, *args):
-        return self.exec_cmd('connect', args)
+    def jsonrpc_listen(self, *args, **kwargs):
+        return self.exec_cmd('listen', args, kwargs)
 
-    def jsonrpc_listen(self, *args):
-        return self.exec_cmd('listen', args)
+    def jsonrpc_clear(self, *args, **kwargs):
+        return self.exec_cmd('clear', args, kwargs)
 
-    def jsonrpc_clear(self, *args):
-        return self.exec_cmd('clear', args)
+    def jsonrpc_profile(self, *args, **kwargs):
+        return self.exec_cmd('profile', args, kwargs)
@@ -0,0 +1,30 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+from twisted.internet import reactor
+
+
+class SettlementQueue(object):
+    """ Collects the payments the node reports received and hands them to
+    the settle callback together, once per reactor turn, in the order they
+    arrived. A burst of payments is settled as one batch instead of each
+    on its own. """
+    def __init__(self, settle_cb):
+        self.settle_cb = settle_cb
+        self.payments = []
+        self.drain_call = None
+
+    def __len__(self):
+        return len(self.payments)
+
+    def add(self, preimage, msats):
+        self.payments.append((preimage, msats))
+        if not self.drain_call:
+            self.drain_call = reactor.callLater(0, self.drain)
+
+    def drain(self):
+        self.drain_call = None
+        payments = self.payments
+        self.payments = []
+        self.settle_cb(payments)
@@ -0,0 +1,271 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import time
+import logging
+
+from twisted.internet import reactor
+
+from moneysocket.beacon.beacon import MoneysocketBeacon
+
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILENAME = "directory.snapshot"
+# tail entries after which a checkpoint is taken without waiting for the
+# interval
+MAX_TAIL_ENTRIES = 10000
+RETRY_SECONDS = 1.0
+
+
+class DirectorySnapshot(object):
+    """ Every account header in one file, written periodically as a
+    checkpoint, plus an append-only tail of the headers committed since.
+    Startup reads the two sequentially instead of one file per account.
+    The account store stays the source of truth, verify() compares the two.
+
+    The snapshot is one JSON line of metadata then one line per account
+    with its header and shared seeds, the seeds being what the directory
+    indexes are built from without decoding any beacons. Tail lines carry
+    the generation of the checkpoint they follow, so lines left over from a
+    crash between writing a checkpoint and truncating the tail are
+    skipped. A batch goes to the tail before the store, the accounts in the
+    last batch are read back from the store on load in case the process
+    died in between. """
+    def __init__(self, store, interval, max_tail=MAX_TAIL_ENTRIES):
+        self.store = store
+        self.path = os.path.join(store.persist_dir, SNAPSHOT_FILENAME)
+        self.tail_path = self.path + ".tail"
+        self.interval = interval
+        self.max_tail = max_tail
+        self.generation = 0
+        # name -> (header json, shared seed hex strings) as last committed,
+        # never the in-memory state which may be ahead of the store
+        self.committed = {}
+        self.tail_entries = 0
+        self.batch = 0
+        # names in the last tail batch, read back from the store on load
+        self.last_batch = set()
+        # a batch is in the tail but its store commit failed
+        self.uncommitted = False
+        self.checkpoint_call = None
+
+    ###########################################################################
+
+    @staticmethod
+    def account_entry(account_db):
+        seeds = [str(ss) for ss in account_db.get_all_shared_seeds()]
+        return account_db.account_name, json.dumps(account_db.db), seeds
+
+    @staticmethod
+    def record_seeds(record):
+        # what account_entry() gives for a record straight from the store
+        return record['shared_seeds'] + [
+            str(MoneysocketBeacon.from_bech32_str(b)[0].get_shared_seed())
+            for b in record['beacons']]
+
+    def read_lines(self, path):
+        f = open(path, 'r')
+        lines = f.read().splitlines()
+        f.close()
+        return lines
+
+    ###########################################################################
+
+    def load(self):
+        # {name: (record, shared seed hex strings)} as of the last commit, or
+        # None if there is no snapshot that can be trusted
+        if not os.path.exists(self.path):
+            return None
+        try:
+            lines = self.read_lines(self.path)
+            meta = json.loads(lines[0])
+            if meta.get('version') != SNAPSHOT_VERSION:
+                logging.info("ignoring snapshot version %s" %
+                             meta.get('version'))
+                return None
+            accounts = {}
+            for line in lines[1:]:
+                entry = json.loads(line)
+                accounts[entry['name']] = (entry['record'], entry['seeds'])
+        except (ValueError, KeyError, IndexError):
+            logging.error("unreadable snapshot: %s" % self.path)
+            return None
+        if len(accounts) != meta['accounts']:
+            logging.error("truncated snapshot: %s" % self.path)
+            return None
+        self.generation = meta['generation']
+        replayed = self.replay_tail(accounts)
+        logging.info("snapshot generation %d: %d accounts, %d tail entries" %
+                     (self.generation, len(accounts), replayed))
+        self.committed = {name: (json.dumps(record), seeds) for
+                          name, (record, seeds) in accounts.items()}
+        self.tail_entries = replayed
+        return accounts
+
+    def replay_tail(self, accounts):
+        if not os.path.exists(self.tail_path):
+            return 0
+        replayed = 0
+        for n, line in enumerate(self.read_lines(self.tail_path)):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a torn final line from a crash mid-append, the store
+                # commit after it never happened
+                logging.error("skipping bad snapshot tail line %d" % n)
+                continue
+            if entry['generation'] != self.generation:
+                continue
+            replayed += 1
+            if entry['batch'] != self.batch:
+                self.batch = entry['batch']
+                self.last_batch = set()
+            self.last_batch.add(entry['name'])
+            if entry['op'] == "rm":
+                _ = accounts.pop(entry['name'], None)
+            else:
+                accounts[entry['name']] = (entry['record'], entry['seeds'])
+        # the tail can be ahead of the store by the one batch
+        for name in self.last_batch:
+            if self.store.has_account(name):
+                record = self.store.read_account(name)
+                accounts[name] = (record,
+                                  DirectorySnapshot.record_seeds(record))
+            else:
+                _ = accounts.pop(name, None)
+        return replayed
+
+    def is_current(self, accounts):
+        # catches account files created, removed or rewritten behind its
+        # back, by hand or by a terminus without snapshots. Every header
+        # written since the checkpoint went to the tail first, so only the
+        # last batch, already re-read from the store, can be newer than the
+        # tail. verify() compares the contents.
+        since = max(os.path.getmtime(path) for path in
+                    (self.path, self.tail_path) if os.path.exists(path))
+        n = 0
+        for name, mtime in self.store.iter_account_mtimes():
+            n += 1
+            if mtime > since and name not in self.last_batch:
+                logging.info("%s written after the snapshot" % name)
+                return False
+        return n == len(accounts)
+
+    def reset(self, account_dbs):
+        # after a full load from the store
+        self.committed = {}
+        for account_db in account_dbs:
+            name, header, seeds = DirectorySnapshot.account_entry(account_db)
+            self.committed[name] = (header, seeds)
+
+    def discard(self):
+        for path in (self.path, self.tail_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    ###########################################################################
+
+    def append_tail(self, lines):
+        self.store.append_lines_synced(self.tail_path, "".join(lines))
+        self.tail_entries += len(lines)
+        if self.tail_entries >= self.max_tail:
+            self.schedule(0)
+
+    def record_batch(self, account_dbs):
+        # called before the store commits the headers
+        self.batch += 1
+        lines = []
+        for account_db in account_dbs:
+            name, header, seeds = DirectorySnapshot.account_entry(account_db)
+            self.committed[name] = (header, seeds)
+            lines.append('{"generation": %d, "batch": %d, "op": "put", '
+                         '"name": %s, "seeds": %s, "record": %s}\n' % (
+                         self.generation, self.batch, json.dumps(name),
+                         json.dumps(seeds), header))
+        if len(lines) > 0:
+            self.uncommitted = True
+            self.append_tail(lines)
+
+    def batch_committed(self):
+        self.uncommitted = False
+
+    def record_remove(self, account_name):
+        # called before the store removes the account
+        if self.committed.pop(account_name, None) is None:
+            return
+        self.batch += 1
+        self.append_tail([json.dumps({'generation': self.generation,
+                                      'batch':      self.batch,
+                                      'op':         "rm",
+                                      'name':       account_name}) + "\n"])
+
+    ###########################################################################
+
+    def schedule(self, delay):
+        if self.checkpoint_call and self.checkpoint_call.active():
+            if self.checkpoint_call.getTime() <= reactor.seconds() + delay:
+                return
+            self.checkpoint_call.cancel()
+        self.checkpoint_call = reactor.callLater(delay, self.checkpoint)
+
+    def stop(self):
+        if self.checkpoint_call and self.checkpoint_call.active():
+            self.checkpoint_call.cancel()
+        self.checkpoint_call = None
+
+    def checkpoint(self):
+        self.stop()
+        if self.uncommitted:
+            # the headers held are ahead of the store until the retry lands
+            self.schedule(RETRY_SECONDS)
+            return
+        start = time.time()
+        generation = self.generation + 1
+        lines = [json.dumps({'version':     SNAPSHOT_VERSION,
+                             'generation':  generation,
+                             'written_at':  start,
+                             'accounts':    len(self.committed)}) + "\n"]
+        for name, (header, seeds) in sorted(self.committed.items()):
+            lines.append('{"name": %s, "seeds": %s, "record": %s}\n' % (
+                         json.dumps(name), json.dumps(seeds), header))
+        written = self.store.write_file_synced(self.path + ".tmp",
+                                               "".join(lines), 'w')
+        os.replace(self.path + ".tmp", self.path)
+        self.store.sync_dir()
+        # tail lines of the old generation are dead from here even if the
+        # truncate doesn't make it to disk
+        self.generation = generation
+        self.store.write_file_synced(self.tail_path, "", 'w')
+        self.tail_entries = 0
+        self.last_batch = set()
+        logging.info("wrote snapshot generation %d: %d accounts, %d bytes "
+                     "in %.2fs" % (generation, len(self.committed), written,
+                                   time.time() - start))
+        if self.interval > 0:
+            self.schedule(self.interval)
+
+    ###########################################################################
+
+    def verify(self, accounts, store_records):
+        # compare what load() gave against the records in the store, returns
+        # a list of the problems found
+        problems = []
+        seen = set()
+        for record in store_records:
+            name = record['account_name']
+            seen.add(name)
+            if name not in accounts:
+                problems.append("%s: in the store, not the snapshot" % name)
+                continue
+            if record != accounts[name][0]:
+                problems.append("%s: header differs from the store" % name)
+            if (DirectorySnapshot.record_seeds(record) !=
+                    accounts[name][1]):
+                problems.append("%s: shared seeds differ from the store" %
+                                name)
+        for name in sorted(set(accounts.keys()) - seen):
+            problems.append("%s: in the snapshot, not the store" % name)
+        return problems
@@ -0,0 +1,291 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import sqlite3
+import logging
+
+from terminus.json_store import legacy_receipt_records
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    name            TEXT PRIMARY KEY,
+    account_uuid    TEXT NOT NULL,
+    wad             TEXT,
+    cap             TEXT,
+    extra           TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS pending (
+    account         TEXT NOT NULL,
+    payment_hash    TEXT NOT NULL,
+    bolt11          TEXT NOT NULL,
+    PRIMARY KEY (account, payment_hash)
+);
+CREATE TABLE IF NOT EXISTS shared_seeds (
+    account         TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    shared_seed     TEXT NOT NULL,
+    PRIMARY KEY (account, position)
+);
+CREATE TABLE IF NOT EXISTS beacons (
+    account         TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    beacon          TEXT NOT NULL,
+    PRIMARY KEY (account, position)
+);
+CREATE TABLE IF NOT EXISTS receipts (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    account         TEXT NOT NULL,
+    session         TEXT NOT NULL,
+    entry           TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_by_account ON receipts (account, id);
+CREATE TABLE IF NOT EXISTS receipt_base (
+    account         TEXT PRIMARY KEY,
+    base_seq        INTEGER NOT NULL
+);
+"""
+
+# record keys that have their own columns or tables, anything else an account
+# record carries is kept in the 'extra' json column
+CORE_KEYS = {'account_name', 'account_uuid', 'wad', 'cap', 'pending',
+             'shared_seeds', 'beacons'}
+
+
+class SqliteAccountStore(object):
+    """ All accounts in a single SQLite database in WAL mode. A commit of a
+    batch of changed accounts is one transaction. """
+    def __init__(self, path):
+        d = os.path.dirname(path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        self.path = path
+        # transactions are managed explicitly with BEGIN/COMMIT
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # balances must survive power loss once a commit has returned
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+    def __str__(self):
+        return "sqlite store: %s" % self.path
+
+    ###########################################################################
+
+    def transaction(self, func, *args):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return result
+
+    def build_record(self, name, account_uuid, wad, cap, extra, pending,
+                     shared_seeds, beacons):
+        record = json.loads(extra)
+        record.update({'account_name': name,
+                       'account_uuid': account_uuid,
+                       'wad':          json.loads(wad),
+                       'cap':          json.loads(cap),
+                       'pending':      pending,
+                       'shared_seeds': shared_seeds,
+                       'beacons':      beacons})
+        return record
+
+    def write_account(self, record):
+        name = record['account_name']
+        extra = {k: v for k, v in record.items() if k not in CORE_KEYS}
+        values = (name, record['account_uuid'], json.dumps(record['wad']),
+                  json.dumps(record['cap']), json.dumps(extra))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO accounts "
+            "(name, account_uuid, wad, cap, extra) VALUES (?, ?, ?, ?, ?)",
+            values)
+        self.conn.execute("DELETE FROM pending WHERE account = ?", (name,))
+        self.conn.executemany(
+            "INSERT INTO pending (account, payment_hash, bolt11) "
+            "VALUES (?, ?, ?)",
+            [(name, payment_hash, bolt11) for payment_hash, bolt11 in
+             record['pending'].items()])
+        self.conn.execute("DELETE FROM shared_seeds WHERE account = ?",
+                          (name,))
+        self.conn.executemany(
+            "INSERT INTO shared_seeds (account, position, shared_seed) "
+            "VALUES (?, ?, ?)",
+            [(name, i, s) for i, s in enumerate(record['shared_seeds'])])
+        self.conn.execute("DELETE FROM beacons WHERE account = ?", (name,))
+        self.conn.executemany(
+            "INSERT INTO beacons (account, position, beacon) "
+            "VALUES (?, ?, ?)",
+            [(name, i, b) for i, b in enumerate(record['beacons'])])
+        # roughly the size of what went in, for the persist metrics
+        return (sum(len(v) for v in values) +
+                sum(len(b) for b in record['pending'].values()) +
+                sum(len(s) for s in record['shared_seeds']) +
+                sum(len(b) for b in record['beacons']))
+
+    def append_receipts(self, account_name, receipt_records):
+        rows = [(account_name, session_id, json.dumps(entry)) for
+                session_id, entry in receipt_records]
+        self.conn.executemany(
+            "INSERT INTO receipts (account, session, entry) VALUES (?, ?, ?)",
+            rows)
+        return sum(len(session_id) + len(entry) for _, session_id, entry in
+                   rows)
+
+    def delete_account(self, account_name):
+        for table in ("pending", "shared_seeds", "beacons", "receipts",
+                      "receipt_base"):
+            self.conn.execute("DELETE FROM %s WHERE account = ?" % table,
+                              (account_name,))
+        self.conn.execute("DELETE FROM accounts WHERE name = ?",
+                          (account_name,))
+
+    ###########################################################################
+
+    def iter_account_names(self):
+        rows = self.conn.execute("SELECT name FROM accounts").fetchall()
+        for (name,) in rows:
+            yield name
+
+    def iter_account_records(self):
+        # one scan per table rather than a handful of queries per account
+        pending = {}
+        for account, payment_hash, bolt11 in self.conn.execute(
+                "SELECT account, payment_hash, bolt11 FROM pending"):
+            pending.setdefault(account, {})[payment_hash] = bolt11
+        shared_seeds = {}
+        for account, shared_seed in self.conn.execute(
+                "SELECT account, shared_seed FROM shared_seeds "
+                "ORDER BY account, position"):
+            shared_seeds.setdefault(account, []).append(shared_seed)
+        beacons = {}
+        for account, beacon in self.conn.execute(
+                "SELECT account, beacon FROM beacons "
+                "ORDER BY account, position"):
+            beacons.setdefault(account, []).append(beacon)
+        rows = self.conn.execute(
+            "SELECT name, account_uuid, wad, cap, extra FROM accounts"
+            ).fetchall()
+        for name, account_uuid, wad, cap, extra in rows:
+            yield self.build_record(name, account_uuid, wad, cap, extra,
+                                    pending.get(name, {}),
+                                    shared_seeds.get(name, []),
+                                    beacons.get(name, []))
+
+    def has_account(self, account_name):
+        row = self.conn.execute("SELECT 1 FROM accounts WHERE name = ?",
+                                (account_name,)).fetchone()
+        return row is not None
+
+    def read_account(self, account_name):
+        row = self.conn.execute(
+            "SELECT name, account_uuid, wad, cap, extra FROM accounts "
+            "WHERE name = ?", (account_name,)).fetchone()
+        pending = {payment_hash: bolt11 for payment_hash, bolt11 in
+                   self.conn.execute(
+                       "SELECT payment_hash, bolt11 FROM pending "
+                       "WHERE account = ?", (account_name,))}
+        shared_seeds = [s for (s,) in self.conn.execute(
+            "SELECT shared_seed FROM shared_seeds WHERE account = ? "
+            "ORDER BY position", (account_name,))]
+        beacons = [b for (b,) in self.conn.execute(
+            "SELECT beacon FROM beacons WHERE account = ? ORDER BY position",
+            (account_name,))]
+        return self.build_record(*row, pending, shared_seeds, beacons)
+
+    def create_account(self, record):
+        self.transaction(self.write_account, record)
+
+    def remove_account(self, account_name):
+        self.transaction(self.delete_account, account_name)
+
+    ###########################################################################
+
+    def iter_receipt_records(self, account_name):
+        rows = self.conn.execute(
+            "SELECT session, entry FROM receipts WHERE account = ? "
+            "ORDER BY id", (account_name,)).fetchall()
+        for session_id, entry in rows:
+            yield session_id, json.loads(entry)
+
+    def replace_receipt_records(self, account_name, receipt_records):
+        def replace():
+            self.conn.execute("DELETE FROM receipts WHERE account = ?",
+                              (account_name,))
+            self.append_receipts(account_name, receipt_records)
+        self.transaction(replace)
+
+    def get_receipt_base_seq(self, account_name):
+        row = self.conn.execute(
+            "SELECT base_seq FROM receipt_base WHERE account = ?",
+            (account_name,)).fetchone()
+        return row[0] if row else 0
+
+    def archive_receipt_records(self, account_name, count, base_seq):
+        # drop the oldest count records, now kept in an archive segment, and
+        # record the seq the remaining ones start at in the same transaction
+        def archive():
+            self.conn.execute(
+                "DELETE FROM receipts WHERE id IN (SELECT id FROM receipts "
+                "WHERE account = ? ORDER BY id LIMIT ?)",
+                (account_name, count))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO receipt_base (account, base_seq) "
+                "VALUES (?, ?)", (account_name, base_seq))
+        self.transaction(archive)
+
+    ###########################################################################
+
+    def commit(self, changes, appended_cb=None):
+        # returns (roughly) the bytes written. All or nothing, so appended_cb
+        # only hears about the journals once the transaction is through.
+        def write_changes():
+            written = 0
+            for account_name, record, receipt_records in changes:
+                if record is not None:
+                    written += self.write_account(record)
+                if len(receipt_records) > 0:
+                    written += self.append_receipts(account_name,
+                                                    receipt_records)
+            return written
+        written = self.transaction(write_changes)
+        if appended_cb:
+            for account_name, _, receipt_records in changes:
+                if len(receipt_records) > 0:
+                    appended_cb(account_name)
+        return written
+
+    ###########################################################################
+
+    def import_json_store(self, json_store):
+        def import_all():
+            n = 0
+            for record in json_store.iter_account_records():
+                account_name = record['account_name']
+                legacy_receipts = record.pop('receipts', None)
+                receipt_records = (
+                    list(legacy_receipt_records(legacy_receipts)) if
+                    legacy_receipts else [])
+                receipt_records += list(
+                    json_store.iter_receipt_records(account_name))
+                self.delete_account(account_name)
+                self.write_account(record)
+                self.append_receipts(account_name, receipt_records)
+                # archive segments are shared by both stores, only the seq
+                # the journal starts at needs carrying over
+                base_seq = json_store.get_receipt_base_seq(account_name)
+                if base_seq > 0:
+                    self.conn.execute(
+                        "INSERT INTO receipt_base (account, base_seq) "
+                        "VALUES (?, ?)", (account_name, base_seq))
+                logging.info("imported %s with %d receipt entries" %
+                             (account_name, len(receipt_records)))
+                n += 1
+            return n
+        return self.transaction(import_all)
@@ -0,0 +1,110 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# run from the repository root:
+#   $ python3 -m unittest discover tests
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from terminus.json_store import JsonAccountStore
+from terminus.sqlite_store import SqliteAccountStore
+
+try:
+    from moneysocket.wad.wad import Wad
+    from terminus.account_db import AccountDb
+    from terminus.persist import PersistQueue
+    from terminus.archive import ReceiptArchive
+except ImportError:
+    AccountDb = None
+
+
+def make_store(backend, persist_dir):
+    if backend == "sqlite":
+        return SqliteAccountStore(os.path.join(persist_dir,
+                                               "terminus.sqlite"))
+    return JsonAccountStore(persist_dir)
+
+
+class TestStoreRemove(unittest.TestCase):
+    def setUp(self):
+        self.persist_dir = tempfile.mkdtemp(prefix="terminus-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.persist_dir)
+
+    def test_remove_never_committed(self):
+        for backend in ("json", "sqlite"):
+            store = make_store(backend, self.persist_dir)
+            store.remove_account("account-0")
+            self.assertFalse(store.has_account("account-0"), backend)
+
+
+@unittest.skipIf(AccountDb is None, "needs twisted and moneysocket")
+class TestAccountDb(unittest.TestCase):
+    def setUp(self):
+        self.persist_dir = tempfile.mkdtemp(prefix="terminus-test-")
+
+    def tearDown(self):
+        if AccountDb.PERSIST_QUEUE:
+            AccountDb.PERSIST_QUEUE.flush()
+        AccountDb.STORE = None
+        AccountDb.PERSIST_QUEUE = None
+        AccountDb.ARCHIVE = None
+        AccountDb.LOADED_RECEIPTS.clear()
+        shutil.rmtree(self.persist_dir)
+
+    def use_backend(self, backend):
+        d = os.path.join(self.persist_dir, backend)
+        os.makedirs(d)
+        AccountDb.STORE = make_store(backend, d)
+        AccountDb.PERSIST_QUEUE = PersistQueue(AccountDb.write_batch)
+        AccountDb.ARCHIVE = ReceiptArchive(os.path.join(d, "archive"))
+
+    def test_create_rm_before_flush(self):
+        for backend in ("json", "sqlite"):
+            self.use_backend(backend)
+            account_db, = AccountDb.create_batch(
+                ["account-0"], Wad.bitcoin(1000), Wad.bitcoin(0))
+            account_db.depersist()
+            AccountDb.PERSIST_QUEUE.flush()
+            self.assertFalse(AccountDb.STORE.has_account("account-0"),
+                             backend)
+            AccountDb.PERSIST_QUEUE = None
+
+    def test_archive_with_open_session(self):
+        for backend in ("json", "sqlite"):
+            self.use_backend(backend)
+            account_db, = AccountDb.create_batch(
+                ["account-0"], Wad.bitcoin(1000), Wad.bitcoin(0))
+            now = time.time()
+            # one wallet stays connected while others come and go
+            account_db.new_receipt_session("open")
+            account_db.add_receipt_entry("open", {'type': "session_start",
+                                                  'time': now})
+            for i in range(10):
+                shared_seed = "closed-%d" % i
+                account_db.new_receipt_session(shared_seed)
+                account_db.add_receipt_entry(shared_seed, {
+                    'type': "session_start", 'time': now})
+                account_db.add_receipt_entry(shared_seed, {
+                    'type': "session_end", 'time': now})
+                account_db.end_receipt_session(shared_seed)
+            AccountDb.PERSIST_QUEUE.flush()
+
+            n = account_db.archive_receipts(5, 0)
+            self.assertEqual(n, 16, backend)
+            self.assertEqual(len(account_db.get_receipts()), 5, backend)
+            page, cursor = account_db.query_receipts(limit=100)
+            self.assertIsNone(cursor, backend)
+            self.assertEqual([seq for seq, _, _ in page],
+                             list(range(20, -1, -1)), backend)
+            AccountDb.PERSIST_QUEUE = None
+
+
+if __name__ == "__main__":
+    unittest.main()
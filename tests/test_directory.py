@@ -0,0 +1,165 @@
+# Copyright (c) 2021 Moneysocket Developers
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE or http://www.opensource.org/licenses/mit-license.php
+
+# run from the repository root:
+#   $ python3 -m unittest discover tests
+
+import random
+import unittest
+
+from terminus.directory import TerminusDirectory
+
+
+class FakeAccount(object):
+    # just the parts of Account the directory looks at
+    def __init__(self, name, shared_seeds=(), pending=()):
+        self.name = name
+        self.shared_seeds = list(shared_seeds)
+        self.pending = {payment_hash: "bolt11" for payment_hash in pending}
+
+    def get_name(self):
+        return self.name
+
+    def get_all_shared_seeds(self):
+        return list(self.shared_seeds)
+
+    def get_pending(self):
+        return list(self.pending.items())
+
+
+class TestDirectory(unittest.TestCase):
+    def setUp(self):
+        self.directory = TerminusDirectory()
+
+    def assertConsistent(self):
+        self.assertEqual(self.directory.check_consistency(), [])
+
+    def test_add_and_remove(self):
+        a = FakeAccount("a", shared_seeds=["seed-a"], pending=["hash-1"])
+        b = FakeAccount("b", pending=["hash-1", "hash-2"])
+        self.directory.add_account(b)
+        self.directory.add_account(a)
+        self.assertConsistent()
+        self.assertEqual(self.directory.account_names, ["a", "b"])
+        self.assertIs(self.directory.lookup_by_seed("seed-a"), a)
+        self.assertEqual(self.directory.lookup_by_payment_hash("hash-1"),
+                         {a, b})
+
+        self.directory.remove_account(a)
+        self.assertConsistent()
+        self.assertIsNone(self.directory.lookup_by_seed("seed-a"))
+        self.assertEqual(self.directory.lookup_by_payment_hash("hash-1"),
+                         {b})
+
+        self.directory.remove_account(b)
+        self.assertConsistent()
+        self.assertEqual(self.directory.lookup_by_payment_hash("hash-2"),
+                         set())
+
+    def test_deltas(self):
+        a = FakeAccount("a")
+        self.directory.add_account(a)
+        a.shared_seeds.append("seed-1")
+        self.directory.add_shared_seed(a, "seed-1")
+        a.pending["hash-1"] = "bolt11"
+        self.directory.add_pending(a, "hash-1")
+        self.assertConsistent()
+
+        a.shared_seeds.remove("seed-1")
+        self.directory.remove_shared_seed(a, "seed-1")
+        del a.pending["hash-1"]
+        self.directory.remove_pending(a, "hash-1")
+        self.assertConsistent()
+        self.assertEqual(self.directory.shared_seeds_by_account, {})
+        self.assertEqual(self.directory.payment_hashes_by_account, {})
+
+    def test_reindex(self):
+        a = FakeAccount("a", shared_seeds=["seed-1", "seed-2"],
+                        pending=["hash-1"])
+        self.directory.add_account(a)
+        # changed behind the directory's back
+        a.shared_seeds = ["seed-2", "seed-3"]
+        a.pending = {"hash-2": "bolt11"}
+        self.assertNotEqual(self.directory.check_consistency(), [])
+        self.directory.reindex_account(a)
+        self.assertConsistent()
+        self.assertIsNone(self.directory.lookup_by_seed("seed-1"))
+        self.assertIs(self.directory.lookup_by_seed("seed-3"), a)
+
+        # adding an account already there reindexes it
+        a.shared_seeds = []
+        self.directory.add_account(a)
+        self.assertConsistent()
+        self.assertEqual(self.directory.account_names, ["a"])
+
+    def test_add_accounts(self):
+        self.directory.add_account(FakeAccount("m", shared_seeds=["seed-m"]))
+        accounts = [FakeAccount(name, shared_seeds=["seed-%s" % name],
+                                pending=["hash-%s" % name])
+                    for name in ["z", "b", "x", "a"]]
+        # one already present, with its seed changed
+        accounts.append(FakeAccount("m", shared_seeds=["seed-m2"]))
+        self.directory.add_accounts(accounts)
+        self.assertConsistent()
+        self.assertEqual(self.directory.account_names,
+                         ["a", "b", "m", "x", "z"])
+        self.assertIsNone(self.directory.lookup_by_seed("seed-m"))
+
+    def test_account_names(self):
+        names = [self.directory.allocate_account_name("account")
+                 for _ in range(3)]
+        self.assertEqual(names, ["account-0", "account-1", "account-2"])
+        accounts = [FakeAccount(name) for name in names]
+        for account in accounts:
+            self.directory.add_account(account)
+        self.directory.remove_account(accounts[1])
+        self.assertConsistent()
+        self.assertEqual(self.directory.allocate_account_name("account"),
+                         "account-1")
+
+    def test_random_sequences(self):
+        for run in range(20):
+            rng = random.Random(run)
+            directory = TerminusDirectory()
+            accounts = {}
+            n = 0
+            for step in range(300):
+                n += 1
+                op = rng.choice(["add", "add", "rm", "seed", "unseed",
+                                 "pending", "unpend", "reindex"])
+                if op == "add" or len(accounts) == 0:
+                    account = FakeAccount("account-%d" % n,
+                                          shared_seeds=["seed-%d" % n])
+                    accounts[account.get_name()] = account
+                    directory.add_account(account)
+                    continue
+                account = accounts[rng.choice(sorted(accounts.keys()))]
+                if op == "rm":
+                    directory.remove_account(account)
+                    del accounts[account.get_name()]
+                elif op == "seed":
+                    account.shared_seeds.append("seed-%d" % n)
+                    directory.add_shared_seed(account, "seed-%d" % n)
+                elif op == "unseed" and len(account.shared_seeds) > 0:
+                    shared_seed = account.shared_seeds.pop()
+                    directory.remove_shared_seed(account, shared_seed)
+                elif op == "pending":
+                    # sometimes a hash another account already has
+                    payment_hash = "hash-%d" % rng.randrange(n)
+                    account.pending[payment_hash] = "bolt11"
+                    directory.add_pending(account, payment_hash)
+                elif op == "unpend" and len(account.pending) > 0:
+                    payment_hash = rng.choice(sorted(account.pending))
+                    del account.pending[payment_hash]
+                    directory.remove_pending(account, payment_hash)
+                elif op == "reindex":
+                    account.shared_seeds = account.shared_seeds[1:]
+                    account.pending["hash-%d" % n] = "bolt11"
+                    directory.reindex_account(account)
+                self.assertEqual(directory.check_consistency(), [],
+                                 "run %d step %d" % (run, step))
+
+
+if __name__ == "__main__":
+    unittest.main()